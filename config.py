@@ -61,6 +61,9 @@ class Settings(BaseSettings):
     max_concurrent_discovery: int = 50  # Max discovery paralleli
     discovery_batch_size: int = 10  # Batch size per discovery
     max_discovery_time: int = 60  # Timeout discovery per reti grandi
+    routing_info_cache_ttl: float = 1.0  # TTL cache get_routing_table_info (0 = disabilitata)
+    discovery_refresh_with_ping: bool = False  # Refresh della NodeCache con ping reali (altrimenti ottimistico)
+    discovery_refresh_concurrency: int = 32  # Ping concorrenti durante il refresh
 
     # Monitoring
     enable_prometheus: bool = False
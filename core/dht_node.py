@@ -1,6 +1,7 @@
 import asyncio
 import json
-from typing import Optional, Dict, Any, List
+import time
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime, timedelta
 from kademlia.network import Server
 import secrets
@@ -40,6 +41,9 @@ class CQKDNode:
         self._message_handlers = {}
         self._operation_results: Dict[str, Any] = {}
         self._lock = asyncio.Lock()
+        # Cache di get_routing_table_info: (timestamp monotonic, info)
+        self.routing_info_cache_ttl = settings.routing_info_cache_ttl
+        self._routing_info_cache: Optional[Tuple[float, Dict[str, Any]]] = None
 
         logger.info(
             "node_initialized",
@@ -95,6 +99,7 @@ class CQKDNode:
         try:
             await self.server.listen(self.port)
             self.state = NodeState.ACTIVE
+            self.invalidate_routing_info_cache()
             logger.info("node_started", node_id=self.node_id, port=self.port)
         except Exception as e:
             self.state = NodeState.ERROR
@@ -145,6 +150,7 @@ class CQKDNode:
                 
                 if total_nodes > 0:
                     # Routing table popolata!
+                    self.invalidate_routing_info_cache()
                     print(f"✓ [{self.node_id}] Bootstrap completato con successo!")
                     print(f"  └─ Routing table: {total_nodes} nodi totali in {len([b for b in router.buckets if len(b.get_nodes()) > 0])} bucket attivi")
                     
@@ -259,6 +265,7 @@ class CQKDNode:
                 logger.warning("dns_hostname_issue_detected", node_id=self.node_id, issue=str(e))
                 try:
                     self.server.refresh_table()
+                    self.invalidate_routing_info_cache()
                     logger.info("routing_table_refresh_completed", node_id=self.node_id)
                     await self.server.set(key, value_to_store)
                     logger.info("data_stored_after_refresh", node_id=self.node_id, key=key)
@@ -339,6 +346,7 @@ class CQKDNode:
         await self.release_role()
         self.server.stop()
         self.state = NodeState.OFF
+        self.invalidate_routing_info_cache()
         logger.info("node_stopped", node_id=self.node_id)
 
 
@@ -346,9 +354,30 @@ class CQKDNode:
         """
         Ottieni informazioni dettagliate sulla routing table, filtrando per i nodi sulla porta 7000.
 
+        Il risultato viene servito da cache per routing_info_cache_ttl secondi
+        (0 disabilita la cache), così endpoint di monitoring interrogati a raffica
+        non riscansionano tutti i bucket ad ogni richiesta.
+
         Returns:
             Dict con statistiche e dettagli nodi
         """
+        ttl = self.routing_info_cache_ttl
+        if ttl > 0 and self._routing_info_cache is not None:
+            cached_at, cached_info = self._routing_info_cache
+            if time.monotonic() - cached_at < ttl:
+                return cached_info
+
+        info = self._build_routing_table_info()
+        if ttl > 0 and "error" not in info:
+            self._routing_info_cache = (time.monotonic(), info)
+        return info
+
+    def invalidate_routing_info_cache(self):
+        """Scarta lo snapshot della routing table in cache"""
+        self._routing_info_cache = None
+
+    def _build_routing_table_info(self) -> Dict[str, Any]:
+        """Costruisce lo snapshot della routing table (senza cache)"""
         try:
             router = self.server.protocol.router
 
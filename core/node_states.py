@@ -1,5 +1,6 @@
+from binascii import unhexlify
 from enum import Enum
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Optional
 
@@ -21,7 +22,7 @@ class NodeRole(str, Enum):
     QPC = "qpc"  # Quantum Photon Collider
 
 
-@dataclass
+@dataclass(slots=True)
 class NodeRoleAssignment:
     """Assegnamento di ruolo a un nodo"""
     role: NodeRole
@@ -35,9 +36,9 @@ class NodeRoleAssignment:
         return datetime.now() > self.expires_at
 
 
-@dataclass
+@dataclass(slots=True)
 class NodeInfo:
-    """Informazioni su un nodo DHT"""
+    """Informazioni su un nodo DHT (slots: un'istanza per nodo in cache/routing)"""
     node_id: str
     address: str
     port: int
@@ -45,11 +46,52 @@ class NodeInfo:
     current_role: Optional[NodeRoleAssignment]
     last_seen: datetime
     capabilities: list[NodeRole]
+    # Vista frozenset delle capacità per test di inclusione O(1)
+    capability_set: frozenset = field(init=False, repr=False, compare=False)
+    # node_id decodificato in bytes, calcolato al primo uso (vedi node_id_bytes)
+    _node_id_bytes: Optional[bytes] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.capability_set = frozenset(self.capabilities)
+
+    @classmethod
+    def from_kademlia(
+        cls,
+        node,
+        state: NodeState,
+        last_seen: datetime,
+        capabilities: list[NodeRole]
+    ) -> "NodeInfo":
+        """
+        Costruisce un NodeInfo da un Node Kademlia (id, ip, port)
+
+        Se node.id è già in bytes viene riusato: node_id_bytes non
+        dovrà rifare l'unhexlify dell'ID esadecimale.
+        """
+        id_bytes = node.id if isinstance(node.id, bytes) else None
+        node_info = cls(
+            node_id=id_bytes.hex() if id_bytes is not None else str(node.id),
+            address=node.ip,
+            port=node.port,
+            state=state,
+            current_role=None,
+            last_seen=last_seen,
+            capabilities=capabilities
+        )
+        node_info._node_id_bytes = id_bytes
+        return node_info
+
+    @property
+    def node_id_bytes(self) -> bytes:
+        """ID del nodo in bytes (unhexlify eseguito una sola volta)"""
+        if self._node_id_bytes is None:
+            self._node_id_bytes = unhexlify(self.node_id)
+        return self._node_id_bytes
 
     def can_accept_role(self, role: NodeRole) -> bool:
         """Verifica se il nodo può accettare un determinato ruolo"""
         return (
             self.state == NodeState.ACTIVE and
-            role in self.capabilities and
+            role in self.capability_set and
             (self.current_role is None or self.current_role.is_expired())
         )
\ No newline at end of file
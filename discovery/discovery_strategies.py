@@ -1,18 +1,56 @@
 import asyncio
-from typing import List, Optional
-from datetime import datetime, timedelta
+import heapq
+import logging
+import math
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
 
+from kademlia.node import Node
+
+from config import settings
 from core.dht_node import CQKDNode
 from core.node_states import NodeRole, NodeInfo
+from discovery.latency_tracker import LatencyTracker
 from discovery.node_cache import NodeCache
 from discovery.node_discovery import NodeDiscoveryService
 from discovery.random_walk import RandomWalkExplorer
-from utils.logging_config import get_logger
+from utils.logging_config import get_logger, is_enabled_for
 
 
 logger = get_logger(__name__)
 
 
+@dataclass(slots=True)
+class PhaseQuota:
+    """
+    Quota condivisa dalle fasi di discovery concorrenti
+    
+    Ogni node_id viene reclamato da una sola fase: le fasi restituiscono
+    nodi disgiunti e si fermano appena i nodi reclamati in totale
+    raggiungono target. I nodi reclamati restano in nodes anche se la
+    fase che li ha reclamati viene poi cancellata.
+    """
+    claimed_ids: Set[str]
+    target: int
+    nodes: List[NodeInfo] = field(default_factory=list)
+    
+    def claim(self, node: NodeInfo) -> bool:
+        """Reclama il nodo; False se già reclamato o quota raggiunta"""
+        if node.node_id in self.claimed_ids or self.reached:
+            return False
+        self.claimed_ids.add(node.node_id)
+        self.nodes.append(node)
+        return True
+    
+    @property
+    def reached(self) -> bool:
+        """True quando i nodi reclamati coprono target"""
+        return len(self.claimed_ids) >= self.target
+
+
 class SmartDiscoveryStrategy:
     """
     Strategia intelligente che combina cache + discovery + random walk
@@ -20,6 +58,34 @@ class SmartDiscoveryStrategy:
     Ottimizzato per il protocollo CQKD che richiede molti nodi distribuiti
     """
     
+    # Frazione stimata di k_per_walk che produce nodi nuovi e compatibili
+    WALK_YIELD_ESTIMATE = 0.5
+    
+    # Cache dei risultati completi di discover_nodes, rivalidati sulla NodeCache
+    REQUEST_CACHE_TTL = 300.0
+    REQUEST_CACHE_MAX_ENTRIES = 1000
+    
+    # Score minimo per usare un nodo in cache: stessa regola per la lookup
+    # sulla NodeCache e per la rivalidazione dei risultati memorizzati
+    MIN_AVAILABILITY_SCORE = 0.7
+    
+    # Timeout adattivi per fase: safety_factor * p99 * 2^timeout_consecutivi
+    LATENCY_MIN_SAMPLES = 20  # Sotto questa soglia si usano i timeout fissi
+    LATENCY_SAFETY_FACTOR = 1.5
+    PHASE_TIMEOUT_FLOOR = 5.0
+    FALLBACK_CLOSING_MARGIN = 1.0  # Tempo lasciato alla chiusura dopo il fallback
+    
+    # Timeout dei ping: PING_RTT_MULTIPLIER * p90 degli RTT riusciti
+    PING_TIMEOUT = 2.0  # Valore a freddo e tetto massimo
+    PING_TIMEOUT_FLOOR = 0.25
+    PING_RTT_MULTIPLIER = 3.0
+    
+    # Scheduler di background: si sveglia alla prima scadenza in cache
+    REFRESH_MAX_SLEEP = 300  # Ogni 5 minuti al massimo (come Kademlia standard)
+    CLEANUP_MAX_SLEEP = 600  # Ogni 10 minuti al massimo
+    BACKGROUND_MIN_SLEEP = 1.0
+    BACKGROUND_WAKEUP_SLACK = 0.5  # Le scadenze usano confronti stretti
+    
     def __init__(
         self,
         coordinator_node: CQKDNode,
@@ -33,24 +99,54 @@ class SmartDiscoveryStrategy:
         self.discovery = NodeDiscoveryService(coordinator_node)
         self.random_walk = RandomWalkExplorer(coordinator_node) if enable_random_walk else None
         
-        # Background tasks
-        self._refresh_task: Optional[asyncio.Task] = None
-        self._cleanup_task: Optional[asyncio.Task] = None
+        # Risultati di discover_nodes: chiave -> (timestamp, node_id)
+        self._request_results: OrderedDict = OrderedDict()
+        
+        # Latenze osservate per fase e timeout consecutivi (per il backoff)
+        self.latency = LatencyTracker()
+        self._phase_timeouts: Dict[str, int] = defaultdict(int)
+        
+        # Statistiche
+        self.stats = {
+            "full_cache_hits": 0,
+            "request_cache_hits": 0,
+            "coalesced_discoveries": 0
+        }
+        
+        # Discovery in corso per firma (single-flight): chiamate identiche
+        # concorrenti attendono lo stesso task invece di rifare il lookup
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        
+        # Node Kademlia già costruiti per i ping: node_id -> Node
+        # (voce liberata quando il nodo esce dalla NodeCache)
+        self._kad_node_cache: Dict[str, Node] = {}
+        if self.cache:
+            self.cache.add_removal_listener(self._evict_kad_node)
+        
+        # Refresh periodico: ping reali con concorrenza limitata, oppure
+        # verifica ottimistica senza I/O (default)
+        self.refresh_with_ping = settings.discovery_refresh_with_ping
+        self.refresh_concurrency = max(1, settings.discovery_refresh_concurrency)
+        
+        # Background: un unico task schedula sia refresh che cleanup
+        self._scheduler_task: Optional[asyncio.Task] = None
     
     async def start_background_tasks(self):
         """Avvia task di background per refresh e cleanup"""
+        # Riparti da uno snapshot fresco della routing table
+        self.coordinator.invalidate_routing_info_cache()
+        
         if self.cache:
-            self._refresh_task = asyncio.create_task(self._periodic_refresh())
-            self._cleanup_task = asyncio.create_task(self._periodic_cleanup())
+            self._scheduler_task = asyncio.create_task(self._background_scheduler())
             
             logger.info("smart_discovery_background_tasks_started")
     
     async def stop_background_tasks(self):
-        """Ferma task di background"""
-        if self._refresh_task:
-            self._refresh_task.cancel()
-        if self._cleanup_task:
-            self._cleanup_task.cancel()
+        """Ferma task di background e attende che termini"""
+        task, self._scheduler_task = self._scheduler_task, None
+        if task and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
         
         logger.info("smart_discovery_background_tasks_stopped")
     
@@ -65,11 +161,12 @@ class SmartDiscoveryStrategy:
         Scopre nodi con strategia ottimizzata e robusta
         
         Processo migliorato:
-        1. Analizza stato della rete con get_routing_table_info()
-        2. Controlla cache per nodi già noti
-        3. Se insufficienti, esegui discovery standard con retry
-        4. Se serve diversificazione, usa random walk
-        5. Fallback aggressivo se ancora insufficienti
+        1. Controlla cache per nodi già noti (ritorna subito se sufficienti)
+        2. Analizza stato della rete con get_routing_table_info()
+        3. Se insufficienti, esegui in parallelo discovery standard e
+           (se serve diversificazione) random walk, fermandosi appena
+           la quota è raggiunta
+        4. Fallback aggressivo se ancora insufficienti
         
         Args:
             required_count: Numero di nodi richiesti
@@ -80,9 +177,55 @@ class SmartDiscoveryStrategy:
         Returns:
             List[str]: Lista di node_id disponibili
         """
-        start_time = datetime.now()
-        discovered_node_ids = []
-        discovery_deadline = start_time + timedelta(seconds=max_discovery_time)
+        key = self._request_key(required_count, required_capabilities, prefer_distributed)
+        
+        cached_ids = self._lookup_request_result(key, required_count)
+        if cached_ids is not None:
+            return cached_ids
+        
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            inflight = asyncio.create_task(self._discover_nodes(
+                key, required_count, required_capabilities,
+                prefer_distributed, max_discovery_time
+            ))
+            self._inflight[key] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["coalesced_discoveries"] += 1
+            logger.debug(
+                "discovery_coalesced",
+                required_count=required_count,
+                capabilities=required_capabilities
+            )
+        
+        # shield: la cancellazione di un chiamante non interrompe gli altri;
+        # ogni chiamante riceve la propria copia della lista. Se tutti i
+        # chiamanti vengono cancellati il task prosegue comunque, al più fino
+        # alla sua deadline (max_discovery_time, più l'eventuale estensione per
+        # reti povere): i nodi trovati finiscono in NodeCache e nella cache
+        # delle richieste, e una chiamata identica nel frattempo vi si aggancia
+        return list(await asyncio.shield(inflight))
+    
+    async def _discover_nodes(
+        self,
+        key: Tuple,
+        required_count: int,
+        required_capabilities: Optional[List[NodeRole]],
+        prefer_distributed: bool,
+        max_discovery_time: int
+    ) -> List[str]:
+        """
+        Corpo di discover_nodes, eseguito una sola volta per firma
+        
+        key è la firma calcolata da discover_nodes (_request_key), usata
+        per memorizzare il risultato.
+        """
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        discovered_node_ids: List[str] = []
+        seen_ids: Set[str] = set()  # Membership O(1) accanto alla lista ordinata
+        discovery_deadline = start_time + max_discovery_time
         
         logger.info(
             "smart_discovery_start",
@@ -92,190 +235,187 @@ class SmartDiscoveryStrategy:
             max_discovery_time=max_discovery_time
         )
         
-        # NUOVO: Analizza lo stato della rete all'inizio
+        # Step 1: Prova dalla cache
+        if self.cache:
+            cached_nodes = self.cache.get_by_capabilities(
+                required_capabilities,
+                required_count,
+                min_availability_score=self.MIN_AVAILABILITY_SCORE
+            ) if required_capabilities else self.cache.get_all_active(
+                min_availability_score=self.MIN_AVAILABILITY_SCORE
+            )
+            
+            self._merge_new_nodes(cached_nodes, discovered_node_ids, seen_ids)
+            
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug(
+                    "nodes_from_cache",
+                    count=len(cached_nodes),
+                    required=required_count
+                )
+            
+            # Fast path: la cache soddisfa già la richiesta, salta analisi di rete,
+            # discovery e random walk
+            if len(discovered_node_ids) >= required_count:
+                self.stats["full_cache_hits"] += 1
+                logger.info(
+                    "cache_hit_full",
+                    discovered=len(discovered_node_ids),
+                    required=required_count,
+                    duration_seconds=round(loop.time() - start_time, 3)
+                )
+                return discovered_node_ids
+        
+        # Analizza lo stato della rete (solo se la cache non basta)
+        # (get_routing_table_info è memoizzato dal nodo: niente rescan dei bucket sotto burst)
+        routing_info: Dict = {}
         try:
             routing_info = self.coordinator.get_routing_table_info()
             network_health = routing_info.get("network_health", {})
             total_nodes = routing_info.get("total_nodes", 0)
             
-            logger.info(
-                "initial_network_analysis",
-                total_nodes=total_nodes,
-                well_distributed=network_health.get("well_distributed", False),
-                distribution_score=network_health.get("distribution_score", 0.0),
-                active_buckets=routing_info.get("active_buckets", 0)
-            )
+            if is_enabled_for(logger, logging.INFO):
+                logger.info(
+                    "initial_network_analysis",
+                    total_nodes=total_nodes,
+                    well_distributed=network_health.get("well_distributed", False),
+                    distribution_score=network_health.get("distribution_score", 0.0),
+                    active_buckets=routing_info.get("active_buckets", 0)
+                )
             
             # Se la rete è in cattivo stato, aumenta il timeout
             if (total_nodes < required_count):
                 
                 # Estendi il timeout per reti in cattivo stato
                 additional_time = min(60, max_discovery_time // 2)
-                discovery_deadline += timedelta(seconds=additional_time)
+                discovery_deadline += additional_time
                 
                 logger.info(
                     "poor_network_detected_extending_timeout",
                     additional_time=additional_time,
-                    new_deadline=discovery_deadline
+                    new_deadline_in=round(discovery_deadline - start_time, 2)
                 )
                 
         except Exception as e:
             logger.warning("failed_to_analyze_network_state", error=str(e))
         
-        # Step 1: Prova dalla cache
-        if self.cache:
-            cached_nodes = self.cache.get_by_capabilities(
-                required_capabilities or [],
-                required_count
-            ) if required_capabilities else self.cache.get_all_active()
-            
-            discovered_node_ids.extend([n.node_id for n in cached_nodes])
-            
-            logger.debug(
-                "nodes_from_cache",
-                count=len(cached_nodes),
-                required=required_count
-            )
-        
-        # Step 2: Se ancora servono nodi, usa discovery standard con retry e timeout
+        # Step 2: Se ancora servono nodi, esegui discovery standard e random walk
+        # in parallelo sotto un'unica deadline, unendo i risultati man mano che arrivano
         remaining = required_count - len(discovered_node_ids)
-        if remaining > 0 and datetime.now() < discovery_deadline:
-            # Calcola timeout adattivo basato sul tempo rimanente
-            time_remaining = (discovery_deadline - datetime.now()).total_seconds()
-            discovery_timeout = max(30, min(time_remaining * 0.6, 60))  # 60% del tempo rimanente
+        if remaining > 0 and loop.time() < discovery_deadline:
+            time_remaining = discovery_deadline - loop.time()
             
-            try:
-                logger.info(
-                    "starting_standard_discovery",
-                    remaining=remaining,
-                    timeout=discovery_timeout
-                )
-                
-                discovery_result = await asyncio.wait_for(
-                    self.discovery.discover_nodes_for_roles(
-                        required_count=remaining * 2,  # Cerca più nodi del necessario
-                        required_capabilities=required_capabilities
-                    ),
-                    timeout=discovery_timeout
-                )
-            except asyncio.TimeoutError:
-                logger.warning("standard_discovery_timeout", remaining=remaining)
-                discovery_result = type('DiscoveryResult', (), {'discovered_nodes': []})()
-            except Exception as e:
-                logger.error("standard_discovery_error", error=str(e))
-                discovery_result = type('DiscoveryResult', (), {'discovered_nodes': []})()
+            # Quota condivisa: le fasi non raccolgono gli stessi nodi e smettono
+            # appena insieme coprono required_count
+            quota = PhaseQuota(claimed_ids=set(seen_ids), target=required_count)
             
-            new_nodes = discovery_result.discovered_nodes
-            discovered_node_ids.extend([n.node_id for n in new_nodes])
+            phases = [
+                asyncio.create_task(self._run_standard_discovery(
+                    remaining, required_capabilities, time_remaining, quota
+                ))
+            ]
+            if prefer_distributed and self.random_walk:
+                phases.append(asyncio.create_task(self._run_random_walk(
+                    remaining, required_capabilities, time_remaining, quota, routing_info
+                )))
             
-            # Aggiungi alla cache
-            if self.cache:
-                for node in new_nodes:
-                    self.cache.add(node)
-            
-            logger.info(
-                "nodes_from_standard_discovery",
-                count=len(new_nodes),
-                remaining_before=remaining,
-                total_after=len(discovered_node_ids)
-            )
-        
-        # Step 3: Se ancora servono nodi, prova random walk con timeout
-        remaining = required_count - len(discovered_node_ids)
-        if remaining > 0 and prefer_distributed and self.random_walk and datetime.now() < discovery_deadline:
-            time_remaining = (discovery_deadline - datetime.now()).total_seconds()
-            walk_timeout = max(20, min(time_remaining * 0.7, 45))  # 70% del tempo rimanente
-            
-            # Calcola parametri adattivi per random walk
-            walks_needed = max(min(remaining // 15, 25), 8)  # Aumentato per reti difficili
-            k_per_walk = min(120, max(25, remaining // walks_needed))  # Più aggressivo
-
             try:
-                logger.info(
-                    "starting_random_walk",
-                    remaining=remaining,
-                    walks_needed=walks_needed,
-                    k_per_walk=k_per_walk,
-                    timeout=walk_timeout
-                )
-                
-                explored_nodes = await asyncio.wait_for(
-                    self.random_walk.explore_network(
-                        walk_count=walks_needed,
-                        k_per_walk=k_per_walk
-                    ),
-                    timeout=walk_timeout
-                )
-            except asyncio.TimeoutError:
-                logger.warning("random_walk_timeout", remaining=remaining)
-                explored_nodes = []
-            except Exception as e:
-                logger.error("random_walk_error", error=str(e))
-                explored_nodes = []
-            
-            # Filtra per capacità se richieste
-            if required_capabilities:
-                explored_nodes = [
-                    node for node in explored_nodes
-                    if all(cap in node.capabilities for cap in required_capabilities)
-                ]
-            
-            # Aggiungi nodi non già scoperti
-            for node in explored_nodes:
-                if node.node_id not in discovered_node_ids:
-                    discovered_node_ids.append(node.node_id)
+                for next_phase in asyncio.as_completed(phases, timeout=time_remaining):
+                    phase_name, phase_nodes = await next_phase
+                    
+                    # Aggiungi nodi non già scoperti
+                    new_nodes = self._merge_new_nodes(
+                        phase_nodes, discovered_node_ids, seen_ids
+                    )
                     
                     # Aggiungi alla cache
-                    if self.cache:
-                        self.cache.add(node)
+                    self._cache_new_nodes(new_nodes)
                     
-                    if len(discovered_node_ids) >= required_count:
+                    if is_enabled_for(logger, logging.INFO):
+                        logger.info(
+                            f"nodes_from_{phase_name}",
+                            count=len(phase_nodes),
+                            new=len(new_nodes),
+                            remaining_before=remaining,
+                            total_after=len(discovered_node_ids)
+                        )
+                    
+                    # Quota raggiunta (anche con nodi reclamati da fasi ancora in
+                    # corso): le fasi rimaste vengono cancellate
+                    if quota.reached:
                         break
+            except asyncio.TimeoutError:
+                logger.warning(
+                    "concurrent_discovery_deadline_reached",
+                    found=len(discovered_node_ids),
+                    required=required_count
+                )
+            finally:
+                pending = [task for task in phases if not task.done()]
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    await asyncio.gather(*pending, return_exceptions=True)
             
-            logger.info(
-                "nodes_from_random_walk",
-                count=len(explored_nodes),
-                remaining_before=remaining,
-                total_after=len(discovered_node_ids)
-            )
+            # Nodi reclamati dalle fasi cancellate (quota raggiunta o deadline)
+            new_nodes = self._merge_new_nodes(quota.nodes, discovered_node_ids, seen_ids)
+            if new_nodes:
+                self._cache_new_nodes(new_nodes)
+                logger.info(
+                    "nodes_from_cancelled_phases",
+                    new=len(new_nodes),
+                    total_after=len(discovered_node_ids)
+                )
         
-        # Step 4: Fallback aggressivo se ancora insufficienti
+        # Step 3: Fallback aggressivo se ancora insufficienti
         remaining = required_count - len(discovered_node_ids)
-        if remaining > 0 and datetime.now() < discovery_deadline:
+        if remaining > 0 and loop.time() < discovery_deadline:
             logger.warning(
                 "attempting_aggressive_fallback",
                 remaining=remaining,
-                time_left=(discovery_deadline - datetime.now()).total_seconds()
+                time_left=round(discovery_deadline - loop.time(), 2)
             )
             
+            fallback_timeout = self._fallback_timeout(discovery_deadline - loop.time())
+            
+            # Inutile chiedere più nodi di quanti la routing table ne conosca
+            fallback_count = remaining * 3  # Massimo sforzo
+            total_known = routing_info.get("total_nodes", 0)
+            if total_known > 0:
+                fallback_count = max(remaining, min(fallback_count, total_known))
+            
             try:
                 # Prova discovery senza filtri e con parametri massimi
-                fallback_result = await asyncio.wait_for(
-                    self.discovery.discover_nodes_for_roles(
-                        required_count=remaining * 3,  # Massimo sforzo
+                phase_start = time.monotonic()
+                async with asyncio.timeout(fallback_timeout):
+                    fallback_result = await self.discovery.discover_nodes_for_roles(
+                        required_count=fallback_count,
                         required_capabilities=None  # Senza filtri
-                    ),
-                    timeout=30.0
-                )
+                    )
+                self._record_phase_latency("fallback", time.monotonic() - phase_start)
                 
                 fallback_nodes = fallback_result.discovered_nodes
-                discovered_node_ids.extend([n.node_id for n in fallback_nodes])
+                new_nodes = self._merge_new_nodes(
+                    fallback_nodes, discovered_node_ids, seen_ids
+                )
                 
                 # Aggiungi alla cache
-                if self.cache:
-                    for node in fallback_nodes:
-                        self.cache.add(node)
+                self._cache_new_nodes(new_nodes)
                 
                 logger.info(
                     "nodes_from_aggressive_fallback",
                     count=len(fallback_nodes),
+                    new=len(new_nodes),
                     total_after=len(discovered_node_ids)
                 )
                 
+            except asyncio.TimeoutError:
+                self._phase_timeouts["fallback"] += 1
+                logger.error("aggressive_fallback_failed", error="timeout")
             except Exception as e:
                 logger.error("aggressive_fallback_failed", error=str(e))
         
-        duration = (datetime.now() - start_time).total_seconds()
+        duration = loop.time() - start_time
         
         # Verifica finale se abbiamo trovato abbastanza nodi
         if len(discovered_node_ids) < required_count:
@@ -283,7 +423,7 @@ class SmartDiscoveryStrategy:
                 "insufficient_nodes_after_all_strategies",
                 found=len(discovered_node_ids),
                 required=required_count,
-                duration=duration,
+                duration=round(duration, 3),
                 strategies_used=["cache", "standard_discovery", "random_walk", "aggressive_fallback"]
             )
             raise ValueError(
@@ -291,13 +431,17 @@ class SmartDiscoveryStrategy:
                 f"richiesti {required_count}. Durata: {duration:.2f}s"
             )
         
-        logger.info(
-            "smart_discovery_complete",
-            discovered=len(discovered_node_ids),
-            required=required_count,
-            duration_seconds=duration,
-            cache_stats=self.cache.get_stats() if self.cache else {}
-        )
+        # get_stats() prende il lock della cache: calcolalo solo se verrà loggato
+        if is_enabled_for(logger, logging.INFO):
+            logger.info(
+                "smart_discovery_complete",
+                discovered=len(discovered_node_ids),
+                required=required_count,
+                duration_seconds=round(duration, 3),
+                cache_stats=self.cache.get_stats() if self.cache else {}
+            )
+        
+        self._store_request_result(key, discovered_node_ids)
         
         # NUOVO: Restituisci TUTTI i nodi trovati, non solo quelli richiesti
         # Questo permette al chiamante di decidere come usare i nodi extra
@@ -308,79 +452,482 @@ class SmartDiscoveryStrategy:
         )
         return discovered_node_ids
     
-    async def _periodic_refresh(self):
-        """Task periodico per refresh dei nodi in cache"""
-        while True:
-            try:
-                await asyncio.sleep(300)  # Ogni 5 minuti (come Kademlia standard)
-                
-                if not self.cache:
-                    continue
-                
-                nodes_to_refresh = self.cache.get_nodes_needing_refresh()
-                
-                if not nodes_to_refresh:
-                    continue
-                
-                logger.info(
-                    "periodic_refresh_start",
-                    nodes_count=len(nodes_to_refresh)
-                )
-                
-                # Verifica disponibilità dei nodi
-                for node in nodes_to_refresh:
-                    # is_available = await self._ping_node(node)
-                    self.cache.update_verification(node.node_id, True)
-                
-                logger.info(
-                    "periodic_refresh_complete",
-                    refreshed=len(nodes_to_refresh)
+    @staticmethod
+    def _request_key(
+        required_count: int,
+        required_capabilities: Optional[List[NodeRole]],
+        prefer_distributed: bool
+    ) -> Tuple:
+        """Firma di una richiesta di discovery (indipendente dall'ordine delle capacità)"""
+        return (frozenset(required_capabilities or ()), required_count, prefer_distributed)
+    
+    def _lookup_request_result(self, key: Tuple, required_count: int) -> Optional[List[str]]:
+        """
+        Risultato recente di una discover_nodes identica, se ancora sufficiente
+        
+        I node_id memorizzati vengono rivalidati sulla NodeCache con la stessa
+        regola della lookup del passo 1 (attivi, non scaduti, score almeno
+        MIN_AVAILABILITY_SCORE). Con il refresh ottimistico (default) gli score
+        calano solo per mark_unavailable: la rivalidazione scarta soprattutto
+        i nodi scaduti o rimossi. Senza NodeCache non si usa la cache.
+        """
+        if not self.cache:
+            return None
+        
+        entry = self._request_results.get(key)
+        if entry is None:
+            return None
+        
+        stored_at, node_ids = entry
+        if time.monotonic() - stored_at >= self.REQUEST_CACHE_TTL:
+            del self._request_results[key]
+            return None
+        
+        valid_ids = self.cache.filter_available(
+            node_ids,
+            min_availability_score=self.MIN_AVAILABILITY_SCORE
+        )
+        if len(valid_ids) < required_count:
+            del self._request_results[key]
+            return None
+        
+        self._request_results.move_to_end(key)
+        self.stats["request_cache_hits"] += 1
+        logger.debug(
+            "request_cache_hit",
+            returning=len(valid_ids),
+            required=required_count
+        )
+        return valid_ids
+    
+    def _store_request_result(self, key: Tuple, node_ids: List[str]):
+        """Memorizza il risultato di una discover_nodes (LRU limitata)"""
+        if not self.cache:
+            return
+        
+        self._request_results[key] = (time.monotonic(), list(node_ids))
+        self._request_results.move_to_end(key)
+        if len(self._request_results) > self.REQUEST_CACHE_MAX_ENTRIES:
+            self._request_results.popitem(last=False)
+    
+    def _phase_timeout(
+        self,
+        phase: str,
+        default: float,
+        ceiling: float,
+        time_remaining: float
+    ) -> float:
+        """
+        Timeout per una fase di discovery derivato dalle latenze osservate
+        
+        Finché la fase non ha almeno LATENCY_MIN_SAMPLES campioni restituisce
+        il valore fisso default (cold start). Dopo ogni timeout consecutivo
+        il budget raddoppia.
+        
+        Args:
+            phase: Nome della fase (std_discovery, random_walk, fallback)
+            default: Timeout fisso usato a freddo
+            ceiling: Timeout massimo ammesso per la fase
+            time_remaining: Tempo residuo prima della deadline globale
+            
+        Returns:
+            float: Timeout in secondi
+        """
+        if self.latency.sample_count(phase) < self.LATENCY_MIN_SAMPLES:
+            return default
+        
+        timeout = (
+            self.LATENCY_SAFETY_FACTOR
+            * self.latency.quantile(phase, 0.99)
+            * 2 ** self._phase_timeouts[phase]
+        )
+        return max(self.PHASE_TIMEOUT_FLOOR, min(timeout, ceiling, time_remaining))
+    
+    def _fallback_timeout(self, time_left: float) -> float:
+        """
+        Budget del fallback aggressivo, proporzionato al tempo rimasto
+        
+        Il margine FALLBACK_CLOSING_MARGIN per la chiusura vale sia a freddo
+        sia con il timeout derivato dalle latenze.
+        """
+        time_available = time_left - self.FALLBACK_CLOSING_MARGIN
+        return self._phase_timeout(
+            "fallback",
+            default=max(self.PHASE_TIMEOUT_FLOOR, min(30.0, time_available)),
+            ceiling=30.0,
+            time_remaining=time_available
+        )
+    
+    def _record_phase_latency(self, phase: str, elapsed: float):
+        """Registra la durata di una fase completata e azzera il backoff"""
+        self.latency.record(phase, elapsed)
+        self._phase_timeouts[phase] = 0
+    
+    @staticmethod
+    def _merge_new_nodes(
+        nodes: List[NodeInfo],
+        discovered_node_ids: List[str],
+        seen_ids: Set[str]
+    ) -> List[NodeInfo]:
+        """
+        Accoda a discovered_node_ids i nodi non ancora visti
+        
+        Args:
+            nodes: Nodi restituiti da una fase di discovery
+            discovered_node_ids: Lista ordinata dei node_id (modificata in-place)
+            seen_ids: Set dei node_id già presenti (modificato in-place)
+            
+        Returns:
+            List[NodeInfo]: Solo i nodi effettivamente nuovi
+        """
+        # Unico passaggio; node_id e metodi legati in locali (LOAD_FAST)
+        new_nodes: List[NodeInfo] = []
+        mark_seen = seen_ids.add
+        append_id = discovered_node_ids.append
+        append_node = new_nodes.append
+        for node in nodes:
+            node_id = node.node_id
+            if node_id in seen_ids:
+                continue
+            mark_seen(node_id)
+            append_id(node_id)
+            append_node(node)
+        return new_nodes
+    
+    def _cache_new_nodes(self, nodes: List[NodeInfo]):
+        """
+        Inserisce in cache solo i nodi non già presenti
+        
+        Reinserire un nodo noto ne azzererebbe hit/miss e timestamp di verifica.
+        """
+        if not self.cache:
+            return
+        
+        to_add = [node for node in nodes if not self.cache.contains_active(node.node_id)]
+        if to_add:
+            self.cache.add_many(to_add)
+    
+    async def _run_standard_discovery(
+        self,
+        remaining: int,
+        required_capabilities: Optional[List[NodeRole]],
+        time_remaining: float,
+        quota: PhaseQuota
+    ) -> Tuple[str, List[NodeInfo]]:
+        """
+        Fase di discovery standard con timeout adattivo
+        
+        Restituisce i nodi reclamati su quota (non raccolti da altre fasi),
+        fermandosi quando la quota condivisa è raggiunta; allo scadere del
+        timeout la fase non produce nodi.
+        
+        Returns:
+            Tuple[str, List[NodeInfo]]: Nome della fase e nodi trovati
+        """
+        discovery_timeout = self._phase_timeout(
+            "std_discovery",
+            default=max(30, min(time_remaining * 0.6, 60)),  # 60% del tempo rimanente
+            ceiling=60,
+            time_remaining=time_remaining
+        )
+        found: List[NodeInfo] = []
+        
+        try:
+            logger.info(
+                "starting_standard_discovery",
+                remaining=remaining,
+                timeout=discovery_timeout
+            )
+            
+            phase_start = time.monotonic()
+            async with asyncio.timeout(discovery_timeout):
+                await self._collect_standard_discovery(
+                    remaining, required_capabilities, quota, found
                 )
-                
-            except asyncio.CancelledError:
+            self._record_phase_latency("std_discovery", time.monotonic() - phase_start)
+        except asyncio.TimeoutError:
+            self._phase_timeouts["std_discovery"] += 1
+            logger.warning(
+                "standard_discovery_timeout",
+                remaining=remaining,
+                partial=len(found)
+            )
+        except Exception as e:
+            logger.error("standard_discovery_error", error=str(e))
+        
+        return "standard_discovery", found
+    
+    async def _collect_standard_discovery(
+        self,
+        remaining: int,
+        required_capabilities: Optional[List[NodeRole]],
+        quota: PhaseQuota,
+        found: List[NodeInfo]
+    ):
+        """Esegue la discovery e reclama nodi nuovi finché la quota non è raggiunta"""
+        result = await self.discovery.discover_nodes_for_roles(
+            required_count=remaining * 2,  # Cerca più nodi del necessario
+            required_capabilities=required_capabilities
+        )
+        
+        for node in result.discovered_nodes:
+            if quota.reached:
                 break
-            except Exception as e:
-                logger.error("periodic_refresh_error", error=str(e))
+            if quota.claim(node):
+                found.append(node)
+    
+    async def _run_random_walk(
+        self,
+        remaining: int,
+        required_capabilities: Optional[List[NodeRole]],
+        time_remaining: float,
+        quota: PhaseQuota,
+        routing_info: Optional[Dict] = None
+    ) -> Tuple[str, List[NodeInfo]]:
+        """
+        Fase di random walk per nodi distribuiti (filtrati per capacità dal walker)
+        
+        Il numero di walk è dimensionato anche sulla routing table osservata
+        (routing_info da get_routing_table_info), se disponibile. I walk sono
+        consumati in streaming: la fase reclama nodi su quota, si ferma appena
+        la quota condivisa è raggiunta e allo scadere del timeout restituisce
+        quelli raccolti fin lì.
+        
+        Returns:
+            Tuple[str, List[NodeInfo]]: Nome della fase e nodi trovati
+        """
+        walk_timeout = self._phase_timeout(
+            "random_walk",
+            default=max(20, min(time_remaining * 0.7, 45)),  # 70% del tempo rimanente
+            ceiling=45,
+            time_remaining=time_remaining
+        )
+        
+        # Calcola parametri adattivi per random walk
+        routing_info = routing_info or {}
+        total_nodes = routing_info.get("total_nodes", 0)
+        active_buckets = routing_info.get("active_buckets", 0)
+        distribution_score = routing_info.get("network_health", {}).get("distribution_score", 0.0)
+        
+        walks_needed = min(max(8, remaining // 15, active_buckets), 25)  # Aumentato per reti difficili
+        if total_nodes > 0:
+            # Routing table piccola: walk in più partirebbero dagli stessi vicini
+            walks_needed = min(walks_needed, max(2, total_nodes // 4))
+        if distribution_score > 0.8:
+            # Rete ben distribuita: bastano meno walk indipendenti
+            walks_needed = max(2, walks_needed // 2)
+        k_per_walk = min(120, max(25, remaining // walks_needed + 20))  # Più aggressivo
+        # Non lanciare più walk di quanti servono a coprire la quota stimata
+        walks_needed = min(
+            walks_needed,
+            max(2, math.ceil(remaining / (k_per_walk * self.WALK_YIELD_ESTIMATE)))
+        )
+        explored_nodes: List[NodeInfo] = []
+        
+        try:
+            logger.info(
+                "starting_random_walk",
+                remaining=remaining,
+                walks_needed=walks_needed,
+                k_per_walk=k_per_walk,
+                timeout=walk_timeout
+            )
+            
+            phase_start = time.monotonic()
+            async with asyncio.timeout(walk_timeout):
+                await self._collect_random_walk(
+                    walks_needed, k_per_walk,
+                    required_capabilities, quota, explored_nodes
+                )
+            self._record_phase_latency("random_walk", time.monotonic() - phase_start)
+        except asyncio.TimeoutError:
+            self._phase_timeouts["random_walk"] += 1
+            logger.warning(
+                "random_walk_timeout",
+                remaining=remaining,
+                partial=len(explored_nodes)
+            )
+        except Exception as e:
+            logger.error("random_walk_error", error=str(e))
+        
+        return "random_walk", explored_nodes
+    
+    async def _collect_random_walk(
+        self,
+        walk_count: int,
+        k_per_walk: int,
+        required_capabilities: Optional[List[NodeRole]],
+        quota: PhaseQuota,
+        explored_nodes: List[NodeInfo]
+    ):
+        """Consuma i walk man mano che terminano, reclamando nodi fino alla quota"""
+        async with aclosing(self.random_walk.iter_explore_network(
+            walk_count, k_per_walk, required_capabilities
+        )) as walks:
+            async for batch in walks:
+                explored_nodes.extend(
+                    node for node in batch if quota.claim(node)
+                )
+                if quota.reached:
+                    break
+    
+    def _background_sleep(self, due_in: Optional[float], max_sleep: float) -> float:
+        """
+        Attesa fino alla prossima scadenza in cache, limitata a max_sleep
+        
+        Con cache vuota si attende max_sleep: un nodo aggiunto ora scadrà
+        comunque non prima di un intervallo completo.
+        """
+        if due_in is None:
+            return max_sleep
+        return min(max_sleep, max(self.BACKGROUND_MIN_SLEEP, due_in + self.BACKGROUND_WAKEUP_SLACK))
     
-    async def _periodic_cleanup(self):
-        """Task periodico per cleanup cache"""
+    async def _background_scheduler(self):
+        """
+        Unico task di background per refresh e cleanup della cache
+        
+        Le prossime esecuzioni stanno in un heap (scadenza, job): si dorme fino
+        alla più vicina, si esegue il job e lo si ripianifica sulla prossima
+        scadenza in cache.
+        """
+        loop = asyncio.get_running_loop()
+        jobs = {
+            "refresh": (
+                self._run_refresh,
+                self.cache.seconds_until_next_refresh,
+                self.REFRESH_MAX_SLEEP
+            ),
+            "cleanup": (
+                self._run_cleanup,
+                self.cache.seconds_until_next_expiry,
+                self.CLEANUP_MAX_SLEEP
+            ),
+        }
+        
+        def next_run(name: str) -> Tuple[float, str]:
+            _, due_in, max_sleep = jobs[name]
+            return loop.time() + self._background_sleep(due_in(), max_sleep), name
+        
+        schedule = [next_run(name) for name in jobs]
+        heapq.heapify(schedule)
+        
         while True:
-            try:
-                await asyncio.sleep(600)  # Ogni 10 minuti
-                
-                if not self.cache:
-                    continue
-                
-                removed = self.cache.cleanup_expired()
-                
-                if removed > 0:
-                    logger.info("cache_cleanup_executed", removed=removed)
-                
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                logger.error("cache_cleanup_error", error=str(e))
+            deadline, name = schedule[0]
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            
+            heapq.heappop(schedule)
+            run, _, _ = jobs[name]
+            await run()
+            heapq.heappush(schedule, next_run(name))
     
-    async def _ping_node(self, node: NodeInfo) -> bool:
-        """Ping un nodo per verificare disponibilità"""
+    async def _run_refresh(self):
+        """Refresh dei nodi in cache che necessitano verifica"""
         try:
-            from kademlia.node import Node
-            import binascii
+            nodes_to_refresh = self.cache.get_nodes_needing_refresh()
             
-            kad_node = Node(
-                binascii.unhexlify(node.node_id),
-                node.address,
-                node.port
+            if not nodes_to_refresh:
+                return
+            
+            logger.info(
+                "periodic_refresh_start",
+                nodes_count=len(nodes_to_refresh)
+            )
+            
+            # Verifica disponibilità dei nodi
+            await self._refresh_nodes(nodes_to_refresh)
+            
+            logger.info(
+                "periodic_refresh_complete",
+                refreshed=len(nodes_to_refresh)
             )
             
-            # ✅ CORRETTO: usa callPing con un solo parametro
-            result = await asyncio.wait_for(
-                self.coordinator.server.protocol.callPing(kad_node),
-                timeout=2.0
+        except Exception as e:
+            logger.error("periodic_refresh_error", error=str(e))
+    
+    async def _refresh_nodes(self, nodes: List[NodeInfo]):
+        """
+        Verifica i nodi con un pool di refresh_concurrency worker
+        
+        I worker consumano un unico iteratore condiviso: la concorrenza resta
+        costante fino all'ultimo nodo (nessun blocco in attesa del ping più
+        lento) e le coroutine vive sono al più refresh_concurrency.
+        """
+        if not self.refresh_with_ping:
+            # Verifica ottimistica: nessun I/O, un solo lock per tutto il batch
+            self.cache.update_verification_many(
+                (node.node_id for node in nodes), True
             )
+            return
+        
+        remaining = iter(nodes)
+        # Il percentile degli RTT si calcola una volta per giro, non per ping
+        timeout = self._ping_timeout()
+        
+        async def worker():
+            # next() è sincrono: nessun nodo viene preso da due worker
+            for node in remaining:
+                is_available = await self._ping_node(node, timeout)
+                self.cache.update_verification(node.node_id, is_available)
+        
+        worker_count = min(self.refresh_concurrency, len(nodes))
+        await asyncio.gather(*(worker() for _ in range(worker_count)))
+    
+    async def _run_cleanup(self):
+        """Cleanup dei nodi scaduti in cache"""
+        try:
+            removed = self.cache.cleanup_expired()
             
-            return result is not None
+            if removed > 0:
+                logger.info("cache_cleanup_executed", removed=removed)
+            
+        except Exception as e:
+            logger.error("cache_cleanup_error", error=str(e))
+    
+    async def _ping_node(self, node: NodeInfo, timeout: Optional[float] = None) -> bool:
+        """
+        Ping un nodo per verificare disponibilità
+        
+        Args:
+            node: Nodo da verificare
+            timeout: Timeout già calcolato (default: _ping_timeout())
+        """
+        if timeout is None:
+            timeout = self._ping_timeout()
+        
+        try:
+            kad_node = self._get_kad_node(node)
+            
+            # call_ping di KademliaProtocol: callPing verrebbe risolto da rpcudp
+            # come RPC remota "callPing" verso un indirizzo non valido
+            ping_start = time.monotonic()
+            async with asyncio.timeout(timeout):
+                result = await self.coordinator.server.protocol.call_ping(kad_node)
+            
+            # rpcudp restituisce (False, None) se il peer non risponde
+            responded = bool(result and result[0])
+            if responded:
+                self.latency.record("ping", time.monotonic() - ping_start)
+            return responded
             
         except Exception:
             return False
-
+    
+    def _ping_timeout(self) -> float:
+        """Timeout del ping derivato dal p90 degli RTT osservati"""
+        if self.latency.sample_count("ping") < self.LATENCY_MIN_SAMPLES:
+            return self.PING_TIMEOUT
+        
+        timeout = self.PING_RTT_MULTIPLIER * self.latency.quantile("ping", 0.9)
+        return max(self.PING_TIMEOUT_FLOOR, min(timeout, self.PING_TIMEOUT))
+    
+    def _evict_kad_node(self, node_id: str):
+        """Rimuove il Node Kademlia di un nodo uscito dalla cache"""
+        self._kad_node_cache.pop(node_id, None)
+    
+    def _get_kad_node(self, node: NodeInfo) -> Node:
+        """Restituisce il Node Kademlia per il nodo, riusando quello già costruito"""
+        kad_node = self._kad_node_cache.get(node.node_id)
+        if kad_node is None or kad_node.ip != node.address or kad_node.port != node.port:
+            kad_node = Node(node.node_id_bytes, node.address, node.port)
+            self._kad_node_cache[node.node_id] = kad_node
+        return kad_node
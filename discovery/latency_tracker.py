@@ -0,0 +1,48 @@
+import math
+from collections import defaultdict, deque
+from typing import Deque, Dict
+
+
+class LatencyTracker:
+    """
+    Finestra scorrevole delle latenze osservate, separata per chiave
+
+    Usato per derivare timeout adattivi dai percentili reali invece
+    che da costanti fisse (es. per fase di discovery o per RTT RPC).
+    """
+
+    DEFAULT_WINDOW_SIZE = 256
+
+    def __init__(self, window_size: int = DEFAULT_WINDOW_SIZE):
+        self.window_size = window_size
+        self._samples: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=self.window_size)
+        )
+
+    def record(self, key: str, seconds: float):
+        """Registra una latenza (in secondi) per la chiave indicata"""
+        self._samples[key].append(seconds)
+
+    def sample_count(self, key: str) -> int:
+        """Numero di campioni disponibili per la chiave"""
+        samples = self._samples.get(key)
+        return len(samples) if samples else 0
+
+    def quantile(self, key: str, q: float) -> float:
+        """
+        Percentile (nearest-rank) delle latenze registrate
+
+        Args:
+            key: Chiave delle latenze
+            q: Quantile in [0.0, 1.0]
+
+        Returns:
+            float: Latenza al quantile richiesto, 0.0 se non ci sono campioni
+        """
+        samples = self._samples.get(key)
+        if not samples:
+            return 0.0
+
+        ordered = sorted(samples)
+        rank = max(1, math.ceil(q * len(ordered)))
+        return ordered[min(rank, len(ordered)) - 1]
@@ -1,34 +1,39 @@
 import asyncio
-from typing import Dict, List, Set, Tuple, Optional
+import logging
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Optional
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 import threading
+import time
 
 from core.node_states import NodeInfo, NodeState, NodeRole
-from utils.logging_config import get_logger
+from utils.logging_config import get_logger, is_enabled_for
 
 
 logger = get_logger(__name__)
 
 
-@dataclass
+@dataclass(slots=True)
 class CachedNode:
-    """Nodo con metadati di caching"""
+    """Nodo con metadati di caching (slots: fino a max_size istanze vive)"""
     node_info: NodeInfo
-    cached_at: datetime
-    last_verified: datetime
+    cached_at: float  # time.monotonic()
+    last_verified: float  # time.monotonic()
     hit_count: int = 0  # Quante volte usato
     miss_count: int = 0  # Quante volte non disponibile
     availability_score: float = 1.0  # 0.0 - 1.0
     
-    def is_expired(self, ttl: timedelta) -> bool:
-        """Verifica se il nodo è scaduto nella cache"""
-        return datetime.now() - self.cached_at > ttl
+    def is_expired(self, ttl: float, now: Optional[float] = None) -> bool:
+        """Verifica se il nodo è scaduto nella cache (ttl in secondi)"""
+        if now is None:
+            now = time.monotonic()
+        return now - self.cached_at > ttl
     
-    def needs_refresh(self, refresh_interval: timedelta) -> bool:
-        """Verifica se il nodo necessita refresh"""
-        return datetime.now() - self.last_verified > refresh_interval
+    def needs_refresh(self, refresh_interval: float, now: Optional[float] = None) -> bool:
+        """Verifica se il nodo necessita refresh (intervallo in secondi)"""
+        if now is None:
+            now = time.monotonic()
+        return now - self.last_verified > refresh_interval
     
     def update_availability_score(self):
         """Aggiorna score di disponibilità basato su hit/miss"""
@@ -59,13 +64,19 @@ class NodeCache:
         refresh_interval_seconds: int = DEFAULT_REFRESH_INTERVAL,
         max_size: int = DEFAULT_MAX_SIZE
     ):
-        self.ttl = timedelta(seconds=ttl_seconds)
-        self.refresh_interval = timedelta(seconds=refresh_interval_seconds)
+        # Secondi, confrontati con time.monotonic() (immune da salti NTP)
+        self.ttl = float(ttl_seconds)
+        self.refresh_interval = float(refresh_interval_seconds)
         self.max_size = max_size
         
-        # Cache principale: node_id -> CachedNode
+        # Cache principale: node_id -> CachedNode, in ordine di cached_at
+        # (i reinserimenti rimuovono prima la voce), quindi di scadenza TTL
         self._cache: Dict[str, CachedNode] = {}
         
+        # node_id in ordine di last_verified: i nodi da verificare sono
+        # sempre in testa, le scansioni si fermano al primo non scaduto
+        self._by_last_verified: "OrderedDict[str, None]" = OrderedDict()
+        
         # Indici per query veloci
         self._by_capability: Dict[NodeRole, Set[str]] = defaultdict(set)
         self._by_state: Dict[NodeState, Set[str]] = defaultdict(set)
@@ -73,6 +84,9 @@ class NodeCache:
         # Lock per thread-safety
         self._lock = threading.RLock()
         
+        # Callback invocate con il node_id di ogni nodo rimosso (scadenza/eviction)
+        self._removal_listeners: List[Callable[[str], None]] = []
+        
         # Statistiche
         self.stats = {
             "hits": 0,
@@ -99,34 +113,118 @@ class NodeCache:
             bool: True se aggiunto, False se cache piena
         """
         with self._lock:
-            # Evict se cache piena
-            if len(self._cache) >= self.max_size:
-                if not self._evict_lru():
-                    logger.warning("cache_full_eviction_failed")
-                    return False
+            if not self._add_locked(node_info, time.monotonic()):
+                return False
             
-            now = datetime.now()
-            cached_node = CachedNode(
-                node_info=node_info,
-                cached_at=now,
-                last_verified=now
-            )
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug(
+                    "node_cached",
+                    node_id=node_info.node_id[:8],
+                    total_cached=len(self._cache)
+                )
             
-            # Aggiungi alla cache
-            self._cache[node_info.node_id] = cached_node
+            return True
+    
+    def add_many(self, nodes: Iterable[NodeInfo]) -> int:
+        """
+        Aggiungi un batch di nodi alla cache con un solo acquisto del lock
+        
+        Args:
+            nodes: Nodi da aggiungere
             
-            # Aggiorna indici
-            for capability in node_info.capabilities:
-                self._by_capability[capability].add(node_info.node_id)
-            self._by_state[node_info.state].add(node_info.node_id)
+        Returns:
+            int: Numero di nodi effettivamente aggiunti
+        """
+        with self._lock:
+            now = time.monotonic()
+            added = 0
+            for node_info in nodes:
+                if not self._add_locked(node_info, now):
+                    break
+                added += 1
             
-            logger.debug(
-                "node_cached",
-                node_id=node_info.node_id[:8],
-                total_cached=len(self._cache)
-            )
+            if added:
+                logger.debug(
+                    "nodes_cached_batch",
+                    added=added,
+                    total_cached=len(self._cache)
+                )
             
-            return True
+            return added
+    
+    def _add_locked(self, node_info: NodeInfo, now: float) -> bool:
+        """Inserisce un nodo e aggiorna gli indici (lock già acquisito)"""
+        # Un reinserimento riparte in coda agli ordini di scadenza/verifica
+        if node_info.node_id in self._cache:
+            self._remove(node_info.node_id)
+        
+        # Evict se cache piena
+        if len(self._cache) >= self.max_size:
+            if not self._evict_lru():
+                logger.warning("cache_full_eviction_failed")
+                return False
+        
+        cached_node = CachedNode(
+            node_info=node_info,
+            cached_at=now,
+            last_verified=now
+        )
+        
+        # Aggiungi alla cache
+        self._cache[node_info.node_id] = cached_node
+        self._by_last_verified[node_info.node_id] = None
+        
+        # Aggiorna indici
+        for capability in node_info.capabilities:
+            self._by_capability[capability].add(node_info.node_id)
+        self._by_state[node_info.state].add(node_info.node_id)
+        
+        return True
+    
+    def add_removal_listener(self, callback: Callable[[str], None]):
+        """
+        Registra una callback chiamata con il node_id di ogni nodo rimosso
+        
+        Permette a strutture derivate (es. oggetti Node per i ping) di
+        liberare le proprie voci. La callback gira sotto il lock della cache.
+        """
+        self._removal_listeners.append(callback)
+    
+    def contains_active(self, node_id: str) -> bool:
+        """
+        Verifica in O(1) se un nodo è in cache e non scaduto
+        
+        Non aggiorna hit/miss: serve solo a evitare reinserimenti.
+        """
+        with self._lock:
+            cached = self._cache.get(node_id)
+            return cached is not None and not cached.is_expired(self.ttl)
+    
+    def filter_available(
+        self,
+        node_ids: Iterable[str],
+        min_availability_score: float = 0.7
+    ) -> List[str]:
+        """
+        Filtra node_id ancora in cache, attivi e affidabili (un solo lock)
+        
+        Args:
+            node_ids: ID da verificare (l'ordine viene preservato)
+            min_availability_score: Score minimo di affidabilità
+            
+        Returns:
+            List[str]: ID ancora validi
+        """
+        with self._lock:
+            now = time.monotonic()
+            valid_ids = []
+            for node_id in node_ids:
+                cached = self._cache.get(node_id)
+                if (cached and not cached.is_expired(self.ttl, now) and
+                    cached.availability_score >= min_availability_score and
+                    cached.node_info.state == NodeState.ACTIVE):
+                    valid_ids.append(node_id)
+            return valid_ids
     
     def get(self, node_id: str) -> Optional[NodeInfo]:
         """
@@ -147,7 +245,8 @@ class NodeCache:
             
             # Verifica TTL
             if cached.is_expired(self.ttl):
-                logger.debug("node_cache_expired", node_id=node_id[:8])
+                if is_enabled_for(logger, logging.DEBUG):
+                    logger.debug("node_cache_expired", node_id=node_id[:8])
                 self._remove(node_id)
                 self.stats["evictions"] += 1
                 return None
@@ -176,24 +275,28 @@ class NodeCache:
             List[NodeInfo]: Nodi che soddisfano i criteri
         """
         with self._lock:
-            # Trova nodi con tutte le capacità richieste
-            candidate_ids = None
+            # Trova nodi con tutte le capacità richieste: intersezione degli
+            # indici partendo dal più piccolo, senza copie intermedie
+            index_sets = sorted(
+                (self._by_capability.get(capability, set())
+                 for capability in frozenset(required_capabilities)),
+                key=len
+            )
             
-            for capability in required_capabilities:
-                capability_nodes = self._by_capability.get(capability, set())
-                if candidate_ids is None:
-                    candidate_ids = capability_nodes.copy()
-                else:
-                    candidate_ids &= capability_nodes
+            if not index_sets or not index_sets[0]:
+                return []
+            
+            candidate_ids = index_sets[0].intersection(*index_sets[1:])
             
             if not candidate_ids:
                 return []
             
             # Filtra per availability score e stato
+            now = time.monotonic()
             valid_nodes = []
             for node_id in candidate_ids:
                 cached = self._cache.get(node_id)
-                if cached and not cached.is_expired(self.ttl):
+                if cached and not cached.is_expired(self.ttl, now):
                     if (cached.availability_score >= min_availability_score and
                         cached.node_info.state == NodeState.ACTIVE):
                         valid_nodes.append((cached.availability_score, cached.node_info))
@@ -203,20 +306,25 @@ class NodeCache:
             
             return [node for _, node in valid_nodes[:count]]
     
-    def get_all_active(self) -> List[NodeInfo]:
+    def get_all_active(self, min_availability_score: float = 0.0) -> List[NodeInfo]:
         """
         Recupera tutti i nodi attivi non scaduti
         
+        Args:
+            min_availability_score: Score minimo di affidabilità (default: nessun filtro)
+        
         Returns:
             List[NodeInfo]: Nodi attivi
         """
         with self._lock:
+            now = time.monotonic()
             active_nodes = []
             
             for node_id in list(self._cache.keys()):
                 cached = self._cache.get(node_id)
-                if cached and not cached.is_expired(self.ttl):
-                    if cached.node_info.state == NodeState.ACTIVE:
+                if cached and not cached.is_expired(self.ttl, now):
+                    if (cached.availability_score >= min_availability_score and
+                        cached.node_info.state == NodeState.ACTIVE):
                         active_nodes.append(cached.node_info)
             
             return active_nodes
@@ -229,28 +337,64 @@ class NodeCache:
                 cached.miss_count += 1
                 cached.update_availability_score()
                 
-                logger.debug(
-                    "node_marked_unavailable",
-                    node_id=node_id[:8],
-                    score=cached.availability_score
-                )
+                if is_enabled_for(logger, logging.DEBUG):
+                    logger.debug(
+                        "node_marked_unavailable",
+                        node_id=node_id[:8],
+                        score=cached.availability_score
+                    )
     
     def get_nodes_needing_refresh(self) -> List[NodeInfo]:
         """
         Ottieni nodi che necessitano refresh
         
+        Scorre i nodi dal meno recentemente verificato e si ferma al primo
+        ancora valido: O(nodi da verificare), non O(cache).
+        
         Returns:
             List[NodeInfo]: Nodi da verificare
         """
         with self._lock:
+            now = time.monotonic()
             to_refresh = []
             
-            for cached in self._cache.values():
-                if cached.needs_refresh(self.refresh_interval):
-                    to_refresh.append(cached.node_info)
+            for node_id in self._by_last_verified:
+                cached = self._cache[node_id]
+                if not cached.needs_refresh(self.refresh_interval, now):
+                    break
+                to_refresh.append(cached.node_info)
             
             return to_refresh
     
+    def seconds_until_next_refresh(self) -> Optional[float]:
+        """
+        Secondi mancanti al primo nodo che necessiterà refresh
+        
+        Returns:
+            Optional[float]: 0.0 se già in ritardo, None se la cache è vuota
+        """
+        with self._lock:
+            if not self._by_last_verified:
+                return None
+            
+            oldest_id = next(iter(self._by_last_verified))
+            oldest = self._cache[oldest_id].last_verified
+            return max(0.0, oldest + self.refresh_interval - time.monotonic())
+    
+    def seconds_until_next_expiry(self) -> Optional[float]:
+        """
+        Secondi mancanti alla prima scadenza TTL in cache
+        
+        Returns:
+            Optional[float]: 0.0 se già scaduto, None se la cache è vuota
+        """
+        with self._lock:
+            if not self._cache:
+                return None
+            
+            oldest = next(iter(self._cache.values())).cached_at
+            return max(0.0, oldest + self.ttl - time.monotonic())
+    
     def update_verification(self, node_id: str, is_available: bool):
         """
         Aggiorna timestamp di verifica dopo ping/check
@@ -260,22 +404,52 @@ class NodeCache:
             is_available: Se il nodo è risultato disponibile
         """
         with self._lock:
-            cached = self._cache.get(node_id)
-            if cached:
-                cached.last_verified = datetime.now()
-                
-                if is_available:
-                    cached.hit_count += 1
-                else:
-                    cached.miss_count += 1
-                
-                cached.update_availability_score()
-                self.stats["refreshes"] += 1
+            self._verify_locked(node_id, is_available, time.monotonic())
+    
+    def update_verification_many(self, node_ids: Iterable[str], is_available: bool) -> int:
+        """
+        Aggiorna la verifica di un batch di nodi con un solo acquisto del lock
+        
+        Args:
+            node_ids: ID dei nodi verificati
+            is_available: Esito comune a tutti i nodi del batch
+            
+        Returns:
+            int: Numero di nodi ancora in cache effettivamente aggiornati
+        """
+        with self._lock:
+            now = time.monotonic()
+            updated = 0
+            for node_id in node_ids:
+                if self._verify_locked(node_id, is_available, now):
+                    updated += 1
+            return updated
+    
+    def _verify_locked(self, node_id: str, is_available: bool, now: float) -> bool:
+        """Registra l'esito di una verifica (lock già acquisito)"""
+        cached = self._cache.get(node_id)
+        if cached is None:
+            return False
+        
+        cached.last_verified = now
+        self._by_last_verified.move_to_end(node_id)
+        
+        if is_available:
+            cached.hit_count += 1
+        else:
+            cached.miss_count += 1
+        
+        cached.update_availability_score()
+        self.stats["refreshes"] += 1
+        return True
     
     def _remove(self, node_id: str):
         """Rimuovi nodo dalla cache (interno)"""
         cached = self._cache.pop(node_id, None)
         if cached:
+            del self._by_last_verified[node_id]
+            for listener in self._removal_listeners:
+                listener(node_id)
             # Rimuovi dagli indici
             for capability in cached.node_info.capabilities:
                 self._by_capability[capability].discard(node_id)
@@ -302,11 +476,12 @@ class NodeCache:
                 lru_node_id = node_id
         
         if lru_node_id:
-            logger.debug(
-                "node_evicted_lru",
-                node_id=lru_node_id[:8],
-                score=min_score
-            )
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug(
+                    "node_evicted_lru",
+                    node_id=lru_node_id[:8],
+                    score=min_score
+                )
             self._remove(lru_node_id)
             self.stats["evictions"] += 1
             return True
@@ -317,15 +492,20 @@ class NodeCache:
         """
         Pulisci nodi scaduti dalla cache
         
+        La cache è in ordine di inserimento: la scansione si ferma
+        al primo nodo non scaduto.
+        
         Returns:
             int: Numero di nodi rimossi
         """
         with self._lock:
+            now = time.monotonic()
             expired_ids = []
             
             for node_id, cached in self._cache.items():
-                if cached.is_expired(self.ttl):
-                    expired_ids.append(node_id)
+                if not cached.is_expired(self.ttl, now):
+                    break
+                expired_ids.append(node_id)
             
             for node_id in expired_ids:
                 self._remove(node_id)
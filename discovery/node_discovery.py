@@ -1,17 +1,32 @@
 import asyncio
-from typing import List, Dict, Any, Set, Optional
+import logging
+from typing import List, Dict, Any, Set, Optional, Tuple
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
+from datetime import datetime
+import json
+import binascii
 import secrets
+import time
+import weakref
+
+from kademlia.crawling import NodeSpiderCrawl
+from kademlia.node import Node
 
 from core.dht_node import CQKDNode
 from core.node_states import NodeState, NodeRole, NodeInfo
-from utils.logging_config import get_logger
+from utils.logging_config import get_logger, is_enabled_for
 
 
 logger = get_logger(__name__)
 
 
+# Capacità assegnate ai nodi scoperti via Kademlia (non annunciano le proprie)
+DEFAULT_NODE_CAPABILITIES = (
+    NodeRole.QSG, NodeRole.BG, NodeRole.QPP,
+    NodeRole.QPM, NodeRole.QPC
+)
+
+
 @dataclass
 class NodeDiscoveryResult:
     """Risultato del processo di discovery"""
@@ -31,16 +46,36 @@ class NodeDiscoveryService:
     
     # Parametri Kademlia standard
     ALPHA = 3  # Parallelism factor per query concorrenti
+    ALPHA_LATE = 6  # Parallelismo del secondo crawl (retry aggressivo)
     K = 20     # Numero di nodi più vicini da trovare
     
     # Timeout e retry
     QUERY_TIMEOUT = 5.0  # Timeout per singola query RPC
     MAX_RETRIES = 3      # Tentativi massimi per nodo non responsivo
+    NEIGHBORS_CACHE_TTL = QUERY_TIMEOUT  # Validità dei vicini locali memorizzati
+    
+    # Cache dei valori letti dalle chiavi fisse di discovery nella DHT.
+    # TTL breve: le pubblicazioni degli altri nodi non la invalidano
+    DHT_VALUE_CACHE_TTL = 10.0
+    DHT_VALUE_CACHED_KEYS = frozenset({
+        "cqkd:discovery:nodes:active",
+        "cqkd:discovery:nodes:all",
+    })
+    
+    # Cache condivisa dai servizi dello stesso coordinator (strategie, random
+    # walk): una pubblicazione locale la invalida per tutti
+    _dht_value_caches: "weakref.WeakKeyDictionary[CQKDNode, Dict[str, Tuple[float, Any]]]" = (
+        weakref.WeakKeyDictionary()
+    )
     
     def __init__(self, coordinator_node: CQKDNode):
         self.coordinator = coordinator_node
-        self._queried_nodes: Set[str] = set()
-        self._active_queries: Dict[str, asyncio.Task] = {}
+        # ID (bytes grezzi, come Node.id di Kademlia) dei nodi già interrogati
+        self._queried_nodes: Set[bytes] = set()
+        # Vicini del nodo locale: (scadenza monotonic, lista Node Kademlia)
+        self._neighbors_cache: Optional[Tuple[float, List]] = None
+        # Valori DHT letti di recente: chiave -> (timestamp monotonic, valore)
+        self._dht_value_cache = self._dht_value_caches.setdefault(coordinator_node, {})
         
     async def discover_nodes_for_roles(
         self,
@@ -57,7 +92,7 @@ class NodeDiscoveryService:
         Returns:
             NodeDiscoveryResult: Risultato con nodi scoperti
         """
-        start_time = datetime.now()
+        start_time = time.monotonic()
         
         logger.info(
             "node_discovery_start",
@@ -85,7 +120,7 @@ class NodeDiscoveryService:
         available_nodes = filtered_nodes  # ✅ Usa direttamente i nodi trovati
 
         
-        duration = (datetime.now() - start_time).total_seconds()
+        duration = time.monotonic() - start_time
         
         # NUOVO: Non limitare i nodi qui, lascia che il chiamante decida
         # Questo è importante per il fallback locale dove vogliamo TUTTI i nodi disponibili
@@ -125,9 +160,6 @@ class NodeDiscoveryService:
             bool: True se pubblicato con successo
         """
         try:
-            import json
-            from datetime import datetime, timedelta
-            
             # Prepara i dati del nodo
             node_data = {
                 'id': node_info.node_id,
@@ -138,6 +170,8 @@ class NodeDiscoveryService:
                 'published_at': datetime.now().isoformat(),
                 'ttl': ttl
             }
+            # Serializzato una sola volta, riusato per tutte le chiavi del nodo
+            node_payload = json.dumps(node_data)
             
             # Chiavi DHT per pubblicazione
             keys = [
@@ -177,13 +211,18 @@ class NodeDiscoveryService:
                         await self.coordinator.server.set(key, json.dumps(existing_nodes))
                     else:
                         # Per le altre chiavi, pubblica direttamente
-                        await self.coordinator.server.set(key, json.dumps(node_data))
+                        await self.coordinator.server.set(key, node_payload)
                     
-                    logger.debug(
-                        "node_info_published",
-                        key=key,
-                        node_id=node_info.node_id[:16]
-                    )
+                    # Il valore memorizzato non riflette più la DHT (per
+                    # tutti i servizi che condividono il coordinator)
+                    self._dht_value_cache.pop(key, None)
+                    
+                    if is_enabled_for(logger, logging.DEBUG):
+                        logger.debug(
+                            "node_info_published",
+                            key=key,
+                            node_id=node_info.node_id[:16]
+                        )
                     
                 except Exception as key_e:
                     logger.warning(
@@ -218,10 +257,6 @@ class NodeDiscoveryService:
         
         Combina NodeSpiderCrawl con query FIND_NODE dirette per massima efficacia.
         """
-        from kademlia.crawling import NodeSpiderCrawl
-        from kademlia.node import Node
-        import binascii
-        
         if target_id is None:
             target_id = self._generate_random_node_id()
         
@@ -271,13 +306,14 @@ class NodeDiscoveryService:
                 logger.warning("no_initial_peers_for_crawl")
                 return []
             
-            logger.debug(
-                "starting_node_spider_crawl",
-                initial_peers=len(initial_peers),
-                dht_nodes=len(dht_nodes) if dht_nodes else 0,
-                ksize=self.K,
-                alpha=self.ALPHA
-            )
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug(
+                    "starting_node_spider_crawl",
+                    initial_peers=len(initial_peers),
+                    dht_nodes=len(dht_nodes) if dht_nodes else 0,
+                    ksize=self.K,
+                    alpha=self.ALPHA
+                )
             
             # Crea e esegui NodeSpiderCrawl
             spider = NodeSpiderCrawl(
@@ -301,14 +337,11 @@ class NodeDiscoveryService:
             # Aggiungi nodi dallo spider crawl
             all_found_nodes.extend(found_nodes)
             
-            # Rimuovi duplicati basandoti sull'ID
-            unique_nodes = []
-            seen_ids = set()
+            # Rimuovi duplicati basandoti sull'ID (bytes grezzi, vince il primo visto)
+            unique_by_id = {}
             for node in all_found_nodes:
-                node_id = node.id.hex() if isinstance(node.id, bytes) else str(node.id)
-                if node_id not in seen_ids:
-                    seen_ids.add(node_id)
-                    unique_nodes.append(node)
+                unique_by_id.setdefault(node.id, node)
+            unique_nodes = list(unique_by_id.values())
             
             logger.info(
                 "node_spider_crawl_completed",
@@ -320,19 +353,9 @@ class NodeDiscoveryService:
             
             # Converti oggetti Node Kademlia in NodeInfo
             discovered_nodes = []
+            seen_at = datetime.now()
             for node in unique_nodes[:target_count]:
-                node_info = NodeInfo(
-                    node_id=node.id.hex() if isinstance(node.id, bytes) else str(node.id),
-                    address=node.ip,
-                    port=node.port,
-                    state=NodeState.ACTIVE,
-                    current_role=None,
-                    last_seen=datetime.now(),
-                    capabilities=[
-                        NodeRole.QSG, NodeRole.BG, NodeRole.QPP,
-                        NodeRole.QPM, NodeRole.QPC
-                    ]
-                )
+                node_info = self._to_node_info(node, seen_at)
                 discovered_nodes.append(node_info)
             
             return discovered_nodes
@@ -355,6 +378,8 @@ class NodeDiscoveryService:
                 # Try to refresh routing table to clear problematic entries
                 try:
                     self.coordinator.server.refresh_table()
+                    self.coordinator.invalidate_routing_info_cache()
+                    self._neighbors_cache = None
                     logger.info("routing_table_refreshed_after_dns_issue")
                 except Exception as refresh_e:
                     logger.warning(
@@ -388,6 +413,8 @@ class NodeDiscoveryService:
                 try:
                     # Refresh completo della routing table
                     self.coordinator.server.refresh_table()
+                    self.coordinator.invalidate_routing_info_cache()
+                    self._neighbors_cache = None
                     
                     # Aspetta un po' per permettere al refresh di propagarsi
                     await asyncio.sleep(2.0)
@@ -418,20 +445,31 @@ class NodeDiscoveryService:
     def _get_initial_kademlia_nodes(self) -> List:
         """
         Ottieni nodi iniziali come oggetti Node Kademlia dalla routing table
+        
+        Il risultato viene riusato per NEIGHBORS_CACHE_TTL secondi: walk
+        paralleli, espansione e retry dello stesso ciclo di discovery
+        condividono una sola find_neighbors. La lista non va modificata.
         """
+        now = time.monotonic()
+        if self._neighbors_cache is not None and now < self._neighbors_cache[0]:
+            return self._neighbors_cache[1]
+        
         try:
-            from kademlia.node import Node
-            
             router = self.coordinator.server.protocol.router
             local_node = self.coordinator.server.node
             
             # Trova nodi vicini usando il router
             neighbors = router.find_neighbors(local_node, k=self.K)
             
-            logger.debug(
-                "kademlia_initial_nodes_retrieved",
-                count=len(neighbors)
-            )
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug(
+                    "kademlia_initial_nodes_retrieved",
+                    count=len(neighbors)
+                )
+            
+            # Routing table vuota (es. bootstrap in corso): non memorizzare
+            if neighbors:
+                self._neighbors_cache = (now + self.NEIGHBORS_CACHE_TTL, neighbors)
             
             return neighbors
             
@@ -494,9 +532,6 @@ class NodeDiscoveryService:
             List: Nodi trovati tramite DHT
         """
         try:
-            from kademlia.node import Node
-            import binascii
-            
             # Prova a recuperare nodi noti dalla DHT usando chiavi di discovery
             discovery_keys = [
                 f"cqkd:discovery:nodes:active",
@@ -508,19 +543,19 @@ class NodeDiscoveryService:
             
             for key in discovery_keys:
                 try:
-                    # Usa il metodo get() nativo della libreria Kademlia
-                    nodes_data = await self.coordinator.server.get(key)
+                    # get() nativo della libreria Kademlia, con cache TTL
+                    nodes_data = await self._get_dht_value(key)
                     
                     if nodes_data:
-                        logger.debug(
-                            "dht_query_found_nodes",
-                            key=key,
-                            data_type=type(nodes_data).__name__
-                        )
+                        if is_enabled_for(logger, logging.DEBUG):
+                            logger.debug(
+                                "dht_query_found_nodes",
+                                key=key,
+                                data_type=type(nodes_data).__name__
+                            )
                         
                         # Se i dati sono una stringa JSON, parsali
                         if isinstance(nodes_data, str):
-                            import json
                             try:
                                 nodes_list = json.loads(nodes_data)
                                 if isinstance(nodes_list, list):
@@ -537,13 +572,15 @@ class NodeDiscoveryService:
                                                     kad_node = Node(node_bytes, address, port)
                                                     found_nodes.append(kad_node)
                                                 except Exception as e:
-                                                    logger.debug(
-                                                        "failed_to_reconstruct_node",
-                                                        node_id=node_id,
-                                                        error=str(e)
-                                                    )
+                                                    if is_enabled_for(logger, logging.DEBUG):
+                                                        logger.debug(
+                                                            "failed_to_reconstruct_node",
+                                                            node_id=node_id,
+                                                            error=str(e)
+                                                        )
                             except json.JSONDecodeError:
-                                logger.debug("invalid_json_in_dht_response", key=key)
+                                if is_enabled_for(logger, logging.DEBUG):
+                                    logger.debug("invalid_json_in_dht_response", key=key)
                         
                         # Se i dati sono già una lista di nodi
                         elif isinstance(nodes_data, list):
@@ -552,11 +589,12 @@ class NodeDiscoveryService:
                                     found_nodes.append(node_item)
                 
                 except Exception as key_e:
-                    logger.debug(
-                        "dht_key_query_failed",
-                        key=key,
-                        error=str(key_e)
-                    )
+                    if is_enabled_for(logger, logging.DEBUG):
+                        logger.debug(
+                            "dht_key_query_failed",
+                            key=key,
+                            error=str(key_e)
+                        )
                     continue
             
             # NUOVO: Prova anche FIND_NODE diretti ai nodi noti
@@ -579,6 +617,32 @@ class NodeDiscoveryService:
             )
             return []
 
+    async def _get_dht_value(self, key: str) -> Any:
+        """
+        Legge una chiave dalla DHT riusando il valore letto negli ultimi
+        DHT_VALUE_CACHE_TTL secondi
+        
+        Walk paralleli e discovery ripetute interrogano le stesse chiavi di
+        discovery: senza cache ogni lettura è una lookup completa sulla rete.
+        Solo le chiavi in DHT_VALUE_CACHED_KEYS vengono memorizzate, e mai
+        l'assenza del valore (None): un nodo appena pubblicato resta visibile.
+        """
+        if key not in self.DHT_VALUE_CACHED_KEYS:
+            return await self.coordinator.server.get(key)
+        
+        now = time.monotonic()
+        
+        entry = self._dht_value_cache.get(key)
+        if entry is not None and now - entry[0] < self.DHT_VALUE_CACHE_TTL:
+            return entry[1]
+        
+        value = await self.coordinator.server.get(key)
+        
+        if value is not None:
+            self._dht_value_cache[key] = (now, value)
+        
+        return value
+    
     async def _expand_with_direct_find_node_queries(
         self,
         target_id: str,
@@ -592,9 +656,6 @@ class NodeDiscoveryService:
             existing_nodes: Lista di nodi già trovati (modificata in-place)
         """
         try:
-            from kademlia.node import Node
-            import binascii
-            
             target_bytes = binascii.unhexlify(target_id)
             
             # Seleziona alcuni nodi noti per query dirette
@@ -607,16 +668,17 @@ class NodeDiscoveryService:
             max_direct_queries = min(self.ALPHA, len(known_nodes))
             query_nodes = known_nodes[:max_direct_queries]
             
-            logger.debug(
-                "starting_direct_find_node_queries",
-                queries_count=len(query_nodes),
-                target_id=target_id[:16] + "..."
-            )
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug(
+                    "starting_direct_find_node_queries",
+                    queries_count=len(query_nodes),
+                    target_id=target_id[:16] + "..."
+                )
             
             # Esegui query FIND_NODE dirette in parallelo
             tasks = []
             for node in query_nodes:
-                if node.id.hex() not in self._queried_nodes:
+                if node.id not in self._queried_nodes:
                     task = self._direct_find_node_query(node, target_bytes)
                     tasks.append(task)
             
@@ -627,10 +689,11 @@ class NodeDiscoveryService:
                     if isinstance(result, list) and result:
                         existing_nodes.extend(result)
             
-            logger.debug(
-                "direct_find_node_queries_completed",
-                new_nodes_found=len([r for r in results if isinstance(r, list) and r])
-            )
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug(
+                    "direct_find_node_queries_completed",
+                    new_nodes_found=len([r for r in results if isinstance(r, list) and r])
+                )
             
         except Exception as e:
             logger.error(
@@ -658,16 +721,17 @@ class NodeDiscoveryService:
             )
             
             # Marca il nodo come interrogato
-            self._queried_nodes.add(target_node.id.hex())
+            self._queried_nodes.add(target_node.id)
             
             return result if result else []
             
         except Exception as e:
-            logger.debug(
-                "direct_find_node_query_failed",
-                target_node=target_node.id.hex()[:16] + "...",
-                error=str(e)
-            )
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug(
+                    "direct_find_node_query_failed",
+                    target_node=target_node.id.hex()[:16] + "...",
+                    error=str(e)
+                )
             return []
 
     async def _retry_discovery_with_aggressive_params(
@@ -692,41 +756,36 @@ class NodeDiscoveryService:
         )
         
         try:
-            # Usa parametri più aggressivi
-            original_alpha = self.ALPHA
-            original_k = self.K
-            
-            # Aumenta parallelismo e numero di nodi da cercare
-            self.ALPHA = min(6, original_alpha * 2)  # Più query parallele
-            self.K = max(target_count * 3, 40)       # Più nodi da trovare
-            
-            logger.debug(
-                "aggressive_params_set",
-                alpha=self.ALPHA,
-                k=self.K,
-                original_alpha=original_alpha,
-                original_k=original_k
-            )
+            # Parametri aggressivi locali al crawl: ALPHA e K condivisi restano
+            # invariati per le ricerche concorrenti (es. random walk paralleli).
+            # Il primo crawl usa ALPHA, questo sale a ALPHA_LATE
+            alpha = min(self.ALPHA_LATE, self.ALPHA * 2)  # Più query parallele
+            ksize = max(target_count * 3, 40)             # Più nodi da trovare
+            
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug(
+                    "aggressive_params_set",
+                    alpha=alpha,
+                    k=ksize,
+                    original_alpha=self.ALPHA,
+                    original_k=self.K
+                )
             
             # Riprova il discovery standard
-            from kademlia.crawling import NodeSpiderCrawl
-            from kademlia.node import Node
-            import binascii
-            
             if target_id is None:
                 target_id = self._generate_random_node_id()
             
             target_bytes = binascii.unhexlify(target_id)
             target_node = Node(target_bytes)
             
-            # Ottieni nodi iniziali dalla routing table
-            initial_peers = self._get_initial_kademlia_nodes()
+            # Nodi iniziali dalla routing table appena aggiornata: ksize vicini,
+            # non la lista memorizzata (più corta e precedente al refresh)
+            initial_peers = self.coordinator.server.protocol.router.find_neighbors(
+                self.coordinator.server.node, k=ksize
+            )
             
             if not initial_peers:
                 logger.warning("no_initial_peers_for_aggressive_retry")
-                # Ripristina parametri originali
-                self.ALPHA = original_alpha
-                self.K = original_k
                 return []
             
             # Crea e esegui NodeSpiderCrawl con parametri aggressivi
@@ -734,8 +793,8 @@ class NodeDiscoveryService:
                 protocol=self.coordinator.server.protocol,
                 node=target_node,
                 peers=initial_peers,
-                ksize=self.K,
-                alpha=self.ALPHA
+                ksize=ksize,
+                alpha=alpha
             )
             
             # Esegui la ricerca con timeout più lungo
@@ -744,10 +803,6 @@ class NodeDiscoveryService:
                 timeout=15.0  # Timeout più lungo per retry aggressivo
             )
             
-            # Ripristina parametri originali
-            self.ALPHA = original_alpha
-            self.K = original_k
-            
             logger.info(
                 "aggressive_discovery_completed",
                 found_nodes=len(found_nodes),
@@ -756,28 +811,14 @@ class NodeDiscoveryService:
             
             # Converti oggetti Node Kademlia in NodeInfo
             discovered_nodes = []
+            seen_at = datetime.now()
             for node in found_nodes[:target_count]:
-                node_info = NodeInfo(
-                    node_id=node.id.hex() if isinstance(node.id, bytes) else str(node.id),
-                    address=node.ip,
-                    port=node.port,
-                    state=NodeState.ACTIVE,
-                    current_role=None,
-                    last_seen=datetime.now(),
-                    capabilities=[
-                        NodeRole.QSG, NodeRole.BG, NodeRole.QPP,
-                        NodeRole.QPM, NodeRole.QPC
-                    ]
-                )
+                node_info = self._to_node_info(node, seen_at)
                 discovered_nodes.append(node_info)
             
             return discovered_nodes
             
         except Exception as e:
-            # Ripristina parametri originali in caso di errore
-            self.ALPHA = original_alpha
-            self.K = original_k
-            
             logger.error(
                 "aggressive_discovery_failed",
                 error=str(e),
@@ -792,30 +833,21 @@ class NodeDiscoveryService:
         try:
             router = self.coordinator.server.protocol.router
             all_nodes = []
+            seen_at = datetime.now()  # Un solo timestamp per snapshot
             
             # Itera su tutti i k-buckets
             for bucket in router.buckets:
                 nodes = bucket.get_nodes()
                 
                 for node in nodes:
-                    node_info = NodeInfo(
-                        node_id=node.id.hex() if isinstance(node.id, bytes) else str(node.id),
-                        address=node.ip,
-                        port=node.port,
-                        state=NodeState.ACTIVE,
-                        current_role=None,
-                        last_seen=datetime.now(),
-                        capabilities=[
-                            NodeRole.QSG, NodeRole.BG, NodeRole.QPP,
-                            NodeRole.QPM, NodeRole.QPC
-                        ]
-                    )
+                    node_info = self._to_node_info(node, seen_at)
                     all_nodes.append(node_info)
             
-            logger.debug(
-                "all_routing_table_nodes_retrieved",
-                count=len(all_nodes)
-            )
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug(
+                    "all_routing_table_nodes_retrieved",
+                    count=len(all_nodes)
+                )
             
             return all_nodes
             
@@ -833,35 +865,19 @@ class NodeDiscoveryService:
         Ottieni nodi iniziali dal routing table del coordinator
         """
         try:
-            # Usa il metodo del router per ottenere i vicini
-            router = self.coordinator.server.protocol.router
-            
-            # Ottieni il nodo locale come punto di partenza
-            local_node = self.coordinator.server.node
-            
-            # Trova tutti i nodi vicini (usa un ID casuale o il locale)
-            # findNeighbors restituisce oggetti Node completi con IP e porta
-            neighbors = router.find_neighbors(local_node)
+            # Vicini del nodo locale (oggetti Node completi con IP e porta)
+            neighbors = self._get_initial_kademlia_nodes()
             
             initial_nodes = []
+            seen_at = datetime.now()
             
             for node in neighbors:
                 # Ora node dovrebbe essere un oggetto Node completo
-                node_info = NodeInfo(
-                    node_id=node.id.hex() if isinstance(node.id, bytes) else str(node.id),
-                    address=node.ip,
-                    port=node.port,
-                    state=NodeState.ACTIVE,
-                    current_role=None,
-                    last_seen=datetime.now(),
-                    capabilities=[
-                        NodeRole.QSG, NodeRole.BG, NodeRole.QPP,
-                        NodeRole.QPM, NodeRole.QPC
-                    ]
-                )
+                node_info = self._to_node_info(node, seen_at)
                 initial_nodes.append(node_info)
             
-            logger.debug("initial_nodes_retrieved", count=len(initial_nodes))
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug("initial_nodes_retrieved", count=len(initial_nodes))
             return initial_nodes
             
         except Exception as e:
@@ -869,99 +885,6 @@ class NodeDiscoveryService:
             return []
 
     
-    def _select_nodes_to_query(
-        self,
-        candidates: List[NodeInfo],
-        count: int
-    ) -> List[NodeInfo]:
-        """
-        Seleziona nodi da interrogare (non ancora interrogati)
-        
-        Args:
-            candidates: Nodi candidati
-            count: Numero di nodi da selezionare
-            
-        Returns:
-            List[NodeInfo]: Nodi selezionati
-        """
-        unqueried = [
-            node for node in candidates
-            if node.node_id not in self._queried_nodes
-        ]
-        
-        return unqueried[:count]
-    
-    async def _parallel_find_node_queries(
-        self,
-        nodes: List[NodeInfo],
-        target_id: str
-    ) -> List[List[NodeInfo]]:
-        """
-        Esegue query FIND_NODE parallele a più nodi
-        
-        Args:
-            nodes: Nodi a cui inviare query
-            target_id: ID target della ricerca
-            
-        Returns:
-            List[List[NodeInfo]]: Liste di nodi restituiti da ogni query
-        """
-        tasks = []
-        
-        for node in nodes:
-            task = self._find_node_query(node, target_id)
-            tasks.append(task)
-        
-        # Esegui query in parallelo con timeout
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Filtra risultati validi (ignora eccezioni)
-        valid_results = [
-            r for r in results
-            if isinstance(r, list) and r
-        ]
-        
-        return valid_results
-    
-
-    def _get_k_closest_nodes(
-        self,
-        nodes: List[NodeInfo],
-        target_id: str,
-        k: int
-    ) -> List[NodeInfo]:
-        """
-        Ottieni i k nodi più vicini al target secondo XOR distance
-        
-        Args:
-            nodes: Lista di nodi
-            target_id: ID target
-            k: Numero di nodi da restituire
-            
-        Returns:
-            List[NodeInfo]: K nodi più vicini
-        """
-        import binascii
-        
-        target_bytes = binascii.unhexlify(target_id)
-        target_int = int.from_bytes(target_bytes, byteorder='big')
-        
-        # Calcola distanza XOR per ogni nodo
-        nodes_with_distance = []
-        for node in nodes:
-            try:
-                node_bytes = binascii.unhexlify(node.node_id)
-                node_int = int.from_bytes(node_bytes, byteorder='big')
-                distance = target_int ^ node_int
-                nodes_with_distance.append((distance, node))
-            except Exception:
-                continue
-        
-        # Ordina per distanza e prendi i k più vicini
-        nodes_with_distance.sort(key=lambda x: x[0])
-        
-        return [node for _, node in nodes_with_distance[:k]]
-    
     async def _verify_node_availability(
         self,
         nodes: List[NodeInfo]
@@ -993,11 +916,8 @@ class NodeDiscoveryService:
             bool: True se disponibile
         """
         try:
-            from kademlia.node import Node
-            import binascii
-            
             kad_node = Node(
-                binascii.unhexlify(node.node_id),
+                node.node_id_bytes,
                 node.address,
                 node.port
             )
@@ -1013,6 +933,22 @@ class NodeDiscoveryService:
         except Exception:
             return False
     
+    @staticmethod
+    def _to_node_info(node, seen_at: datetime) -> NodeInfo:
+        """
+        Converte un Node Kademlia in NodeInfo
+        
+        Args:
+            node: Node Kademlia (id, ip, port)
+            seen_at: Timestamp last_seen condiviso dal batch di conversione
+        """
+        return NodeInfo.from_kademlia(
+            node,
+            state=NodeState.ACTIVE,
+            last_seen=seen_at,
+            capabilities=list(DEFAULT_NODE_CAPABILITIES)
+        )
+    
     @staticmethod
     def _generate_random_node_id() -> str:
         """Genera un ID nodo casuale per exploration"""
@@ -1023,5 +959,5 @@ class NodeDiscoveryService:
         node: NodeInfo,
         required: List[NodeRole]
     ) -> bool:
-        """Verifica se un nodo ha le capacità richieste"""
-        return all(cap in node.capabilities for cap in required)
+        """Verifica se un nodo ha le capacità richieste (test sul frozenset del nodo)"""
+        return node.capability_set.issuperset(required)
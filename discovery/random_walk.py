@@ -1,12 +1,14 @@
 import asyncio
+import logging
 import secrets
-from typing import List, Set
-from datetime import datetime
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional, Set
 
 from core.dht_node import CQKDNode
-from core.node_states import NodeInfo
+from core.node_states import NodeInfo, NodeRole
 from discovery.node_discovery import NodeDiscoveryService
-from utils.logging_config import get_logger
+from utils.logging_config import get_logger, is_enabled_for
 
 
 logger = get_logger(__name__)
@@ -28,7 +30,9 @@ class RandomWalkExplorer:
     async def explore_network(
         self,
         walk_count: int = 10,
-        k_per_walk: int = 20
+        k_per_walk: int = 20,
+        target: Optional[int] = None,
+        required_capabilities: Optional[List[NodeRole]] = None
     ) -> List[NodeInfo]:
         """
         Esegue random walk sulla DHT per scoprire nodi distribuiti
@@ -36,11 +40,52 @@ class RandomWalkExplorer:
         Args:
             walk_count: Numero di walk da eseguire
             k_per_walk: Nodi da trovare per ogni walk
+            target: Se indicato, termina appena sono stati scoperti
+                target nodi compatibili e cancella i walk ancora attivi
+            required_capabilities: Se indicate, vengono restituiti solo
+                i nodi che le possiedono tutte
             
         Returns:
-            List[NodeInfo]: Nodi scoperti (diversificati)
+            List[NodeInfo]: Nodi scoperti (diversificati e compatibili)
         """
-        start_time = datetime.now()
+        discovered_nodes: List[NodeInfo] = []
+        
+        async with aclosing(self.iter_explore_network(
+            walk_count, k_per_walk, required_capabilities
+        )) as walks:
+            async for batch in walks:
+                discovered_nodes.extend(batch)
+                
+                # Quota raggiunta: i walk rimanenti sarebbero solo RTT sprecati
+                if target is not None and len(discovered_nodes) >= target:
+                    break
+        
+        return discovered_nodes
+    
+    async def iter_explore_network(
+        self,
+        walk_count: int = 10,
+        k_per_walk: int = 20,
+        required_capabilities: Optional[List[NodeRole]] = None
+    ) -> AsyncIterator[List[NodeInfo]]:
+        """
+        Variante in streaming di explore_network
+        
+        Produce, al termine di ogni walk, i nodi compatibili non ancora visti.
+        Chiudere il generatore (aclose, o uscire da aclosing) cancella i walk
+        ancora in corso.
+        
+        Args:
+            walk_count: Numero di walk da eseguire
+            k_per_walk: Nodi da trovare per ogni walk
+            required_capabilities: Se indicate, vengono prodotti solo
+                i nodi che le possiedono tutte
+            
+        Yields:
+            List[NodeInfo]: Nodi nuovi e compatibili di un walk completato
+        """
+        start_time = time.monotonic()
+        required_caps = frozenset(required_capabilities) if required_capabilities else None
         
         logger.info(
             "random_walk_exploration_start",
@@ -49,30 +94,47 @@ class RandomWalkExplorer:
         )
         
         # Esegui walk in parallelo per velocità
-        tasks = []
-        for i in range(walk_count):
-            task = self._single_random_walk(i, k_per_walk)
-            tasks.append(task)
-        
-        walk_results = await asyncio.gather(*tasks, return_exceptions=True)
+        tasks = [
+            asyncio.create_task(self._single_random_walk(i, k_per_walk))
+            for i in range(walk_count)
+        ]
         
-        # Combina risultati e rimuovi duplicati
-        discovered_nodes = {}
-        for result in walk_results:
-            if isinstance(result, list):
+        # Produci i risultati man mano che i walk terminano, senza duplicati
+        seen_ids: Set[str] = set()  # Include i nodi scartati per capacità
+        matching_count = 0
+        walks_completed = 0
+        try:
+            for next_walk in asyncio.as_completed(tasks):
+                result = await next_walk
+                walks_completed += 1
+                
+                batch = []
                 for node in result:
-                    discovered_nodes[node.node_id] = node
-        
-        duration = (datetime.now() - start_time).total_seconds()
-        
-        logger.info(
-            "random_walk_exploration_complete",
-            walks_completed=len([r for r in walk_results if isinstance(r, list)]),
-            unique_nodes_discovered=len(discovered_nodes),
-            duration_seconds=duration
-        )
-        
-        return list(discovered_nodes.values())
+                    node_id = node.node_id
+                    if node_id in seen_ids:
+                        continue
+                    seen_ids.add(node_id)
+                    if required_caps is None or required_caps.issubset(node.capability_set):
+                        batch.append(node)
+                
+                if batch:
+                    matching_count += len(batch)
+                    yield batch
+        finally:
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            
+            logger.info(
+                "random_walk_exploration_complete",
+                walks_completed=walks_completed,
+                walks_cancelled=walk_count - walks_completed,
+                unique_nodes_discovered=len(seen_ids),
+                matching_nodes=matching_count,
+                duration_seconds=time.monotonic() - start_time
+            )
     
     async def _single_random_walk(
         self,
@@ -96,11 +158,12 @@ class RandomWalkExplorer:
         region = random_target_id[:8]
         self._explored_regions.add(region)
         
-        logger.debug(
-            "random_walk_start",
-            walk_id=walk_id,
-            target_region=region
-        )
+        if is_enabled_for(logger, logging.DEBUG):
+            logger.debug(
+                "random_walk_start",
+                walk_id=walk_id,
+                target_region=region
+            )
         
         try:
             # Usa iterativeFindNode verso target casuale
@@ -109,11 +172,12 @@ class RandomWalkExplorer:
                 target_id=random_target_id
             )
             
-            logger.debug(
-                "random_walk_complete",
-                walk_id=walk_id,
-                nodes_found=len(nodes)
-            )
+            if is_enabled_for(logger, logging.DEBUG):
+                logger.debug(
+                    "random_walk_complete",
+                    walk_id=walk_id,
+                    nodes_found=len(nodes)
+                )
             
             return nodes
             
@@ -0,0 +1,750 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from core.node_states import NodeInfo, NodeRole, NodeState
+from discovery.discovery_strategies import PhaseQuota, SmartDiscoveryStrategy
+from discovery.node_discovery import NodeDiscoveryResult
+
+
+class FakeCoordinator:
+    """Coordinator minimale: solo gli attributi usati dal codice sotto test"""
+
+    def __init__(self, protocol=None):
+        self.server = SimpleNamespace(protocol=protocol)
+
+    def invalidate_routing_info_cache(self):
+        pass
+
+
+def make_node(index: int) -> NodeInfo:
+    """NodeInfo con ID esadecimale a 160 bit derivato dall'indice"""
+    return NodeInfo(
+        node_id=f"{index:040x}",
+        address="127.0.0.1",
+        port=7000 + index,
+        state=NodeState.ACTIVE,
+        current_role=None,
+        last_seen=datetime.now(),
+        capabilities=[NodeRole.QSG, NodeRole.BG]
+    )
+
+
+def make_strategy(protocol=None) -> SmartDiscoveryStrategy:
+    return SmartDiscoveryStrategy(FakeCoordinator(protocol), enable_random_walk=False)
+
+
+@pytest.mark.asyncio
+async def test_standard_discovery_skips_seen_and_stops_at_quota():
+    """La fase standard scarta i nodi già reclamati e si ferma alla quota condivisa"""
+    strategy = make_strategy()
+    nodes = [make_node(i) for i in range(6)]
+    calls = []
+
+    async def discover_nodes_for_roles(required_count, required_capabilities=None):
+        calls.append(required_count)
+        return NodeDiscoveryResult(discovered_nodes=list(nodes))
+
+    strategy.discovery.discover_nodes_for_roles = discover_nodes_for_roles
+
+    quota = PhaseQuota(claimed_ids={nodes[0].node_id}, target=3)
+    phase, found = await strategy._run_standard_discovery(2, None, 60.0, quota)
+
+    assert phase == "standard_discovery"
+    assert found == [nodes[1], nodes[2]]
+    assert calls == [4]
+    assert quota.claimed_ids == {n.node_id for n in nodes[:3]}
+
+
+def warm_up(strategy: SmartDiscoveryStrategy, phase: str, seconds: float):
+    """Registra LATENCY_MIN_SAMPLES durate identiche per la fase"""
+    for _ in range(strategy.LATENCY_MIN_SAMPLES):
+        strategy._record_phase_latency(phase, seconds)
+
+
+def test_phase_timeout_uses_default_when_cold():
+    """Sotto LATENCY_MIN_SAMPLES campioni si usa il timeout fisso"""
+    strategy = make_strategy()
+    assert strategy._phase_timeout("std_discovery", 42.0, 60.0, 90.0) == 42.0
+
+    for _ in range(strategy.LATENCY_MIN_SAMPLES - 1):
+        strategy._record_phase_latency("std_discovery", 10.0)
+    assert strategy._phase_timeout("std_discovery", 42.0, 60.0, 90.0) == 42.0
+
+
+def test_phase_timeout_from_p99_when_warm():
+    """A caldo: LATENCY_SAFETY_FACTOR * p99, limitato da floor, ceiling e tempo residuo"""
+    strategy = make_strategy()
+    warm_up(strategy, "std_discovery", 10.0)
+
+    assert strategy._phase_timeout("std_discovery", 42.0, 60.0, 90.0) == 15.0
+    assert strategy._phase_timeout("std_discovery", 42.0, 12.0, 90.0) == 12.0
+    assert strategy._phase_timeout("std_discovery", 42.0, 60.0, 8.0) == 8.0
+
+    warm_up(strategy, "random_walk", 1.0)
+    assert strategy._phase_timeout("random_walk", 42.0, 60.0, 90.0) == strategy.PHASE_TIMEOUT_FLOOR
+
+
+def test_phase_timeout_backs_off_after_timeouts():
+    """Ogni timeout consecutivo raddoppia il budget; una fase completata lo azzera"""
+    strategy = make_strategy()
+    warm_up(strategy, "std_discovery", 10.0)
+
+    strategy._phase_timeouts["std_discovery"] = 1
+    assert strategy._phase_timeout("std_discovery", 42.0, 100.0, 100.0) == 30.0
+    strategy._phase_timeouts["std_discovery"] = 2
+    assert strategy._phase_timeout("std_discovery", 42.0, 100.0, 100.0) == 60.0
+
+    strategy._record_phase_latency("std_discovery", 10.0)
+    assert strategy._phase_timeout("std_discovery", 42.0, 100.0, 100.0) == 15.0
+
+
+@pytest.mark.asyncio
+async def test_standard_discovery_timeout_increments_backoff():
+    """Un timeout reale della fase incrementa il contatore usato per il backoff"""
+    strategy = make_strategy()
+    strategy.PHASE_TIMEOUT_FLOOR = 0.01
+    warm_up(strategy, "std_discovery", 0.02)
+
+    async def discover_nodes_for_roles(required_count, required_capabilities=None):
+        await asyncio.sleep(10)
+
+    strategy.discovery.discover_nodes_for_roles = discover_nodes_for_roles
+
+    phase, found = await strategy._run_standard_discovery(
+        2, None, 60.0, PhaseQuota(claimed_ids=set(), target=2)
+    )
+
+    assert found == []
+    assert strategy._phase_timeouts["std_discovery"] == 1
+    assert strategy._phase_timeout("std_discovery", 42.0, 60.0, 60.0) == pytest.approx(0.06)
+
+
+@pytest.mark.asyncio
+async def test_refresh_without_ping_verifies_optimistically():
+    """Con il ping disabilitato (default) nessun nodo viene pingato"""
+    strategy = make_strategy()
+    nodes = [make_node(i) for i in range(5)]
+    strategy.cache.add_many(nodes)
+
+    async def ping_node(node, timeout=None):
+        raise AssertionError("ping non atteso")
+
+    strategy._ping_node = ping_node
+    assert strategy.refresh_with_ping is False
+
+    await strategy._refresh_nodes(nodes)
+
+    assert strategy.cache.stats["refreshes"] == 5
+    assert strategy.cache.filter_available(n.node_id for n in nodes) == [n.node_id for n in nodes]
+
+
+@pytest.mark.asyncio
+async def test_refresh_with_ping_bounds_concurrency():
+    """Il pool non supera refresh_concurrency ping e pinga ogni nodo una volta"""
+    strategy = make_strategy()
+    strategy.refresh_with_ping = True
+    strategy.refresh_concurrency = 4
+    nodes = [make_node(i) for i in range(20)]
+    strategy.cache.add_many(nodes)
+
+    in_flight = 0
+    max_in_flight = 0
+    pinged = []
+
+    async def ping_node(node, timeout=None):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        pinged.append(node.node_id)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return int(node.node_id, 16) % 2 == 0
+
+    strategy._ping_node = ping_node
+
+    await strategy._refresh_nodes(nodes)
+
+    assert max_in_flight == 4
+    assert sorted(pinged) == sorted(n.node_id for n in nodes)
+    assert strategy.cache.filter_available(n.node_id for n in nodes) == [
+        n.node_id for n in nodes[::2]
+    ]
+
+
+class HangingProtocol:
+    """Protocollo i cui ping non ricevono mai risposta"""
+
+    async def call_ping(self, node):
+        await asyncio.sleep(60)
+
+
+@pytest.mark.asyncio
+async def test_refresh_with_ping_times_out_unresponsive_nodes():
+    """I ping senza risposta scadono al timeout e marcano i nodi non disponibili"""
+    strategy = make_strategy(HangingProtocol())
+    strategy.refresh_with_ping = True
+    strategy.PING_TIMEOUT = 0.05
+    nodes = [make_node(i) for i in range(1, 9)]
+    strategy.cache.add_many(nodes)
+
+    await asyncio.wait_for(strategy._refresh_nodes(nodes), timeout=1.0)
+
+    assert strategy.cache.filter_available(n.node_id for n in nodes) == []
+    assert strategy.cache.stats["refreshes"] == len(nodes)
+
+
+class ScriptedProtocol:
+    """Protocollo che risponde ai ping con il risultato indicato"""
+
+    def __init__(self, result):
+        self.result = result
+        self.pinged = []
+
+    async def call_ping(self, node):
+        self.pinged.append(node)
+        return self.result
+
+
+def test_ping_timeout_cold_and_warm():
+    """A freddo PING_TIMEOUT; a caldo PING_RTT_MULTIPLIER * p90 entro [floor, PING_TIMEOUT]"""
+    strategy = make_strategy()
+    assert strategy._ping_timeout() == strategy.PING_TIMEOUT
+
+    for _ in range(strategy.LATENCY_MIN_SAMPLES):
+        strategy.latency.record("ping", 0.2)
+    assert strategy._ping_timeout() == pytest.approx(0.6)
+
+    fast = make_strategy()
+    for _ in range(fast.LATENCY_MIN_SAMPLES):
+        fast.latency.record("ping", 0.01)
+    assert fast._ping_timeout() == fast.PING_TIMEOUT_FLOOR
+
+    slow = make_strategy()
+    for _ in range(slow.LATENCY_MIN_SAMPLES):
+        slow.latency.record("ping", 5.0)
+    assert slow._ping_timeout() == slow.PING_TIMEOUT
+
+
+@pytest.mark.asyncio
+async def test_ping_node_records_rtt_only_on_reply():
+    """Solo i ping con risposta contribuiscono agli RTT del timeout adattivo"""
+    node = make_node(1)
+
+    answered = make_strategy(ScriptedProtocol((True, b"\x01" * 20)))
+    assert await answered._ping_node(node) is True
+    assert answered.latency.sample_count("ping") == 1
+    assert answered.coordinator.server.protocol.pinged[0].id == node.node_id_bytes
+
+    unanswered = make_strategy(ScriptedProtocol((False, None)))
+    assert await unanswered._ping_node(node) is False
+    assert unanswered.latency.sample_count("ping") == 0
+
+
+@pytest.mark.asyncio
+async def test_refresh_uses_one_timeout_per_round():
+    """Il timeout adattivo viene calcolato una volta e passato a ogni ping del giro"""
+    strategy = make_strategy()
+    strategy.refresh_with_ping = True
+    for _ in range(strategy.LATENCY_MIN_SAMPLES):
+        strategy.latency.record("ping", 0.2)
+    nodes = [make_node(i) for i in range(6)]
+    strategy.cache.add_many(nodes)
+    timeouts = []
+
+    async def ping_node(node, timeout=None):
+        timeouts.append(timeout)
+        return True
+
+    strategy._ping_node = ping_node
+
+    await strategy._refresh_nodes(nodes)
+
+    assert timeouts == [pytest.approx(0.6)] * len(nodes)
+
+
+class FakeClock:
+    """Sostituto di time.monotonic() controllato dal test"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def cached_strategy(count: int):
+    """Strategia con `count` nodi già in NodeCache"""
+    strategy = make_strategy()
+    nodes = [make_node(i) for i in range(count)]
+    strategy.cache.add_many(nodes)
+    return strategy, [node.node_id for node in nodes]
+
+
+def forbid_discovery(strategy: SmartDiscoveryStrategy):
+    async def discover(*args, **kwargs):
+        raise AssertionError("discovery non attesa")
+
+    strategy._discover_nodes = discover
+
+
+@pytest.mark.asyncio
+async def test_request_cache_hit_skips_discovery():
+    """Una richiesta identica recente viene servita dalla cache, in copia"""
+    strategy, node_ids = cached_strategy(3)
+    key = strategy._request_key(2, [NodeRole.BG, NodeRole.QSG], True)
+    strategy._store_request_result(key, node_ids)
+    forbid_discovery(strategy)
+
+    first = await strategy.discover_nodes(2, [NodeRole.QSG, NodeRole.BG])
+    first.clear()
+    second = await strategy.discover_nodes(2, [NodeRole.QSG, NodeRole.BG])
+
+    assert second == node_ids
+    assert strategy.stats["request_cache_hits"] == 2
+
+
+def test_request_cache_expires(monkeypatch):
+    """Dopo REQUEST_CACHE_TTL la voce viene scartata"""
+    clock = FakeClock()
+    monkeypatch.setattr("discovery.discovery_strategies.time", clock)
+    strategy, node_ids = cached_strategy(3)
+    key = strategy._request_key(2, None, True)
+    strategy._store_request_result(key, node_ids)
+
+    clock.now += strategy.REQUEST_CACHE_TTL - 1
+    assert strategy._lookup_request_result(key, 2) == node_ids
+
+    clock.now += 1
+    assert strategy._lookup_request_result(key, 2) is None
+    assert key not in strategy._request_results
+
+
+def test_request_cache_evicts_least_recently_used():
+    """Oltre REQUEST_CACHE_MAX_ENTRIES esce la voce usata meno di recente"""
+    strategy, node_ids = cached_strategy(3)
+    strategy.REQUEST_CACHE_MAX_ENTRIES = 2
+    keys = [strategy._request_key(count, None, True) for count in (1, 2, 3)]
+
+    strategy._store_request_result(keys[0], node_ids)
+    strategy._store_request_result(keys[1], node_ids)
+    assert strategy._lookup_request_result(keys[0], 1) == node_ids
+    strategy._store_request_result(keys[2], node_ids)
+
+    assert list(strategy._request_results) == [keys[0], keys[2]]
+
+
+def test_request_cache_revalidates_on_node_cache():
+    """I nodi sotto MIN_AVAILABILITY_SCORE vengono scartati; se non bastano è un miss"""
+    strategy, node_ids = cached_strategy(4)
+    key = strategy._request_key(2, None, True)
+    strategy._store_request_result(key, node_ids)
+
+    strategy.cache.mark_unavailable(node_ids[0])
+    assert strategy._lookup_request_result(key, 2) == node_ids[1:]
+
+    strategy.cache.mark_unavailable(node_ids[1])
+    strategy.cache.mark_unavailable(node_ids[2])
+    assert strategy._lookup_request_result(key, 2) is None
+    assert key not in strategy._request_results
+
+
+@pytest.mark.asyncio
+async def test_cache_lookup_and_request_cache_share_availability_rule():
+    """Il passo 1 senza capacità esclude gli stessi nodi scartati dalla rivalidazione"""
+    strategy, node_ids = cached_strategy(3)
+    strategy.cache.mark_unavailable(node_ids[0])
+    key = strategy._request_key(2, None, True)
+
+    found = await strategy._discover_nodes(key, 2, None, True, 90)
+
+    assert found == node_ids[1:]
+    assert strategy.stats["full_cache_hits"] == 1
+    assert strategy.cache.filter_available(
+        node_ids, min_availability_score=strategy.MIN_AVAILABILITY_SCORE
+    ) == found
+
+
+class GatedDiscovery:
+    """_discover_nodes sostitutivo che termina solo quando il test lo sblocca"""
+
+    def __init__(self, result=None, error=None):
+        self.result = result if result is not None else ["a", "b"]
+        self.error = error
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.finished = False
+
+    async def __call__(self, key, required_count, required_capabilities,
+                       prefer_distributed, max_discovery_time):
+        self.calls += 1
+        await self.release.wait()
+        self.finished = True
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def gated_strategy(**kwargs):
+    strategy = make_strategy()
+    gate = GatedDiscovery(**kwargs)
+    strategy._discover_nodes = gate
+    return strategy, gate
+
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_identical_calls():
+    """N chiamate identiche concorrenti avviano un solo task; ognuna riceve una copia"""
+    strategy, gate = gated_strategy()
+    callers = [
+        asyncio.create_task(strategy.discover_nodes(2, [NodeRole.QSG]))
+        for _ in range(5)
+    ]
+    await asyncio.sleep(0)
+
+    assert len(strategy._inflight) == 1
+    gate.release.set()
+    results = await asyncio.gather(*callers)
+
+    assert gate.calls == 1
+    assert strategy.stats["coalesced_discoveries"] == 4
+    assert results == [["a", "b"]] * 5
+    assert len({id(result) for result in results}) == 5
+
+
+@pytest.mark.asyncio
+async def test_single_flight_distinct_signatures_run_separately():
+    """Firme diverse non vengono accorpate"""
+    strategy, gate = gated_strategy()
+    callers = [
+        asyncio.create_task(strategy.discover_nodes(2, [NodeRole.QSG])),
+        asyncio.create_task(strategy.discover_nodes(3, [NodeRole.QSG])),
+        asyncio.create_task(strategy.discover_nodes(2, [NodeRole.QSG], prefer_distributed=False)),
+    ]
+    await asyncio.sleep(0)
+    gate.release.set()
+    await asyncio.gather(*callers)
+
+    assert gate.calls == 3
+    assert strategy.stats["coalesced_discoveries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_caller():
+    """Cancellare un chiamante non interrompe il task condiviso né gli altri"""
+    strategy, gate = gated_strategy()
+    cancelled = asyncio.create_task(strategy.discover_nodes(2))
+    waiting = asyncio.create_task(strategy.discover_nodes(2))
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    await asyncio.gather(cancelled, return_exceptions=True)
+    gate.release.set()
+
+    assert await waiting == ["a", "b"]
+    assert cancelled.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_single_flight_task_outlives_all_callers():
+    """Con tutti i chiamanti cancellati il task prosegue fino alla fine e libera _inflight"""
+    strategy, gate = gated_strategy()
+    caller = asyncio.create_task(strategy.discover_nodes(2))
+    await asyncio.sleep(0)
+    task = next(iter(strategy._inflight.values()))
+
+    caller.cancel()
+    await asyncio.gather(caller, return_exceptions=True)
+    assert not task.done()
+
+    gate.release.set()
+    assert await task == ["a", "b"]
+    assert gate.finished
+    assert strategy._inflight == {}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_propagates_error_to_every_waiter():
+    """Un ValueError del task raggiunge tutti i chiamanti accorpati"""
+    strategy, gate = gated_strategy(error=ValueError("Nodi insufficienti"))
+    callers = [asyncio.create_task(strategy.discover_nodes(2)) for _ in range(3)]
+    await asyncio.sleep(0)
+    gate.release.set()
+
+    results = await asyncio.gather(*callers, return_exceptions=True)
+
+    assert gate.calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert strategy._inflight == {}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_next_call_starts_fresh():
+    """Terminato il task, una nuova chiamata identica avvia una nuova discovery"""
+    strategy, gate = gated_strategy()
+    gate.release.set()
+
+    assert await strategy.discover_nodes(2) == ["a", "b"]
+    assert strategy._inflight == {}
+    assert await strategy.discover_nodes(2) == ["a", "b"]
+
+    assert gate.calls == 2
+    assert strategy.stats["coalesced_discoveries"] == 0
+
+
+class ScriptedWalker:
+    """RandomWalkExplorer sostitutivo: produce i batch indicati, poi resta in attesa"""
+
+    def __init__(self, batches, delay=0.01):
+        self.batches = batches
+        self.delay = delay
+        self.closed = False
+
+    async def iter_explore_network(self, walk_count, k_per_walk, required_capabilities=None):
+        try:
+            for batch in self.batches:
+                await asyncio.sleep(self.delay)
+                yield list(batch)
+            await asyncio.sleep(60)
+        finally:
+            self.closed = True
+
+
+def stub_standard_discovery(strategy: SmartDiscoveryStrategy, nodes, delay=0.0):
+    async def discover_nodes_for_roles(required_count, required_capabilities=None):
+        await asyncio.sleep(delay)
+        return NodeDiscoveryResult(discovered_nodes=list(nodes))
+
+    strategy.discovery.discover_nodes_for_roles = discover_nodes_for_roles
+
+
+@pytest.mark.asyncio
+async def test_concurrent_phases_share_quota():
+    """Il walk non riraccoglie i nodi della fase standard e si ferma sulla quota totale"""
+    strategy = make_strategy()
+    nodes = [make_node(i) for i in range(4)]
+    stub_standard_discovery(strategy, nodes[:3])
+    strategy.random_walk = ScriptedWalker([nodes])
+    key = strategy._request_key(4, None, True)
+
+    found = await asyncio.wait_for(strategy._discover_nodes(key, 4, None, True, 90), 1.0)
+
+    assert found == [n.node_id for n in nodes]
+    assert strategy.random_walk.closed
+
+
+@pytest.mark.asyncio
+async def test_concurrent_phases_return_disjoint_nodes():
+    """Le fasi reclamano nodi disgiunti: l'unione copre la quota senza fallback"""
+    strategy = make_strategy()
+    nodes = [make_node(i) for i in range(6)]
+    stub_standard_discovery(strategy, nodes, delay=0.05)
+    strategy.random_walk = ScriptedWalker([nodes[:2]])
+    phases = {}
+
+    for name in ("_run_standard_discovery", "_run_random_walk"):
+        run = getattr(strategy, name)
+
+        async def recording(*args, run=run, **kwargs):
+            phase, found = await run(*args, **kwargs)
+            phases[phase] = [n.node_id for n in found]
+            return phase, found
+
+        setattr(strategy, name, recording)
+
+    key = strategy._request_key(4, None, True)
+    found = await asyncio.wait_for(strategy._discover_nodes(key, 4, None, True, 90), 1.0)
+
+    assert phases["standard_discovery"] == [n.node_id for n in nodes[2:4]]
+    assert sorted(found) == sorted(n.node_id for n in nodes[:4])
+
+
+@pytest.mark.asyncio
+async def test_quota_reached_cancels_and_drains_pending_phase():
+    """Raggiunta la quota la fase ancora in corso viene cancellata e attesa"""
+    strategy = make_strategy()
+    nodes = [make_node(i) for i in range(3)]
+    stub_standard_discovery(strategy, nodes)
+    walk = {"started": False, "closed": False}
+
+    async def hanging_walk(*args, **kwargs):
+        walk["started"] = True
+        try:
+            await asyncio.sleep(60)
+        finally:
+            walk["closed"] = True
+
+    strategy.random_walk = ScriptedWalker([])
+    strategy._run_random_walk = hanging_walk
+    key = strategy._request_key(3, None, True)
+
+    found = await asyncio.wait_for(strategy._discover_nodes(key, 3, None, True, 90), 1.0)
+
+    assert found == [n.node_id for n in nodes]
+    assert walk == {"started": True, "closed": True}
+
+
+@pytest.mark.asyncio
+async def test_deadline_merges_partial_results_and_cancels_phases():
+    """Alla deadline le fasi pendenti vengono cancellate senza perdere i nodi già reclamati"""
+    strategy = make_strategy()
+    nodes = [make_node(i) for i in range(2)]
+    stub_standard_discovery(strategy, nodes[:1])
+    strategy.random_walk = ScriptedWalker([[nodes[0], nodes[1]]])
+    key = strategy._request_key(3, None, True)
+
+    with pytest.raises(ValueError, match="trovati 2"):
+        await asyncio.wait_for(strategy._discover_nodes(key, 3, None, True, 0.2), 1.0)
+
+    assert strategy.random_walk.closed
+    assert strategy.cache.filter_available(n.node_id for n in nodes) == [n.node_id for n in nodes]
+
+
+def test_fallback_timeout_keeps_closing_margin_cold_and_warm():
+    """Il fallback lascia FALLBACK_CLOSING_MARGIN prima della deadline anche a caldo"""
+    strategy = make_strategy()
+    margin = strategy.FALLBACK_CLOSING_MARGIN
+
+    assert strategy._fallback_timeout(12.0) == 12.0 - margin
+    assert strategy._fallback_timeout(100.0) == 30.0
+
+    warm_up(strategy, "fallback", 20.0)
+    assert strategy._fallback_timeout(12.0) == 12.0 - margin
+    assert strategy._fallback_timeout(100.0) == 30.0
+    assert strategy._fallback_timeout(3.0) == strategy.PHASE_TIMEOUT_FLOOR
+
+
+@pytest.mark.asyncio
+async def test_warm_fallback_ends_before_deadline():
+    """A caldo il fallback aggressivo termina entro la deadline meno il margine"""
+    strategy = make_strategy()
+    strategy.PHASE_TIMEOUT_FLOOR = 0.05
+    strategy.FALLBACK_CLOSING_MARGIN = 0.2
+    warm_up(strategy, "fallback", 10.0)
+    fallback_calls = []
+
+    async def discover_nodes_for_roles(required_count, required_capabilities=None):
+        if required_capabilities is None:
+            fallback_calls.append(asyncio.get_running_loop().time())
+            await asyncio.sleep(10)
+        return NodeDiscoveryResult(discovered_nodes=[])
+
+    strategy.discovery.discover_nodes_for_roles = discover_nodes_for_roles
+    loop = asyncio.get_running_loop()
+    key = strategy._request_key(1, [NodeRole.QSG], False)
+
+    start = loop.time()
+    with pytest.raises(ValueError):
+        await strategy._discover_nodes(key, 1, [NodeRole.QSG], False, 0.6)
+    elapsed = loop.time() - start
+
+    assert len(fallback_calls) == 1
+    assert strategy._phase_timeouts["fallback"] == 1
+    assert elapsed < 0.6 - strategy.FALLBACK_CLOSING_MARGIN + 0.1
+
+
+def test_background_sleep_clamps():
+    """Attesa = scadenza + slack, entro [BACKGROUND_MIN_SLEEP, max_sleep]; cache vuota -> max_sleep"""
+    strategy = make_strategy()
+    min_sleep = strategy.BACKGROUND_MIN_SLEEP
+    slack = strategy.BACKGROUND_WAKEUP_SLACK
+
+    assert strategy._background_sleep(None, 300) == 300
+    assert strategy._background_sleep(0.0, 300) == max(min_sleep, slack)
+    assert strategy._background_sleep(10.0, 300) == 10.0 + slack
+    assert strategy._background_sleep(1000.0, 300) == 300
+
+
+class SchedulerProbe:
+    """Registra i job eseguiti dallo scheduler e segnala quando ne ha visti `count`"""
+
+    def __init__(self, strategy: SmartDiscoveryStrategy, count: int):
+        self.events = []
+        self.count = count
+        self.done = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.start = self.loop.time()
+        strategy._run_refresh = self.job("refresh")
+        strategy._run_cleanup = self.job("cleanup")
+
+    def job(self, name: str):
+        async def run():
+            self.events.append((name, self.loop.time() - self.start))
+            if len(self.events) >= self.count:
+                self.done.set()
+        return run
+
+    @property
+    def names(self):
+        return [name for name, _ in self.events[:self.count]]
+
+
+def fast_scheduler(refresh_due, expiry_due, refresh_max=1.0, cleanup_max=1.0):
+    """Strategia con scheduler veloce e scadenze della cache pilotate dal test"""
+    strategy = make_strategy()
+    strategy.BACKGROUND_MIN_SLEEP = 0.001
+    strategy.BACKGROUND_WAKEUP_SLACK = 0.0
+    strategy.REFRESH_MAX_SLEEP = refresh_max
+    strategy.CLEANUP_MAX_SLEEP = cleanup_max
+    strategy.cache.seconds_until_next_refresh = refresh_due
+    strategy.cache.seconds_until_next_expiry = expiry_due
+    return strategy
+
+
+@pytest.mark.asyncio
+async def test_scheduler_runs_jobs_in_deadline_order():
+    """Lo scheduler esegue sempre il job con la scadenza più vicina (cleanup limitato a CLEANUP_MAX_SLEEP)"""
+    strategy = fast_scheduler(lambda: 0.04, lambda: 10.0, cleanup_max=0.1)
+    probe = SchedulerProbe(strategy, 4)
+
+    await strategy.start_background_tasks()
+    await asyncio.wait_for(probe.done.wait(), 1.0)
+    await strategy.stop_background_tasks()
+
+    assert probe.names == ["refresh", "refresh", "cleanup", "refresh"]
+    cleanup_at = next(at for name, at in probe.events if name == "cleanup")
+    assert cleanup_at >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_scheduler_reschedules_on_next_cache_deadline():
+    """Dopo ogni esecuzione il job viene ripianificato sulla nuova scadenza in cache"""
+    refresh_deadlines = iter([0.02, 0.3])
+    strategy = fast_scheduler(
+        lambda: next(refresh_deadlines, 10.0), lambda: None, cleanup_max=0.08
+    )
+    probe = SchedulerProbe(strategy, 5)
+
+    await strategy.start_background_tasks()
+    await asyncio.wait_for(probe.done.wait(), 1.0)
+    await strategy.stop_background_tasks()
+
+    assert probe.names == ["refresh", "cleanup", "cleanup", "cleanup", "refresh"]
+    assert probe.events[4][1] >= 0.32
+
+
+@pytest.mark.asyncio
+async def test_stop_background_tasks_cancels_and_awaits_scheduler():
+    """stop_background_tasks cancella l'unico task, anche durante un job, e ne attende la fine"""
+    strategy = fast_scheduler(lambda: 0.0, lambda: None)
+    job = {"started": asyncio.Event(), "closed": False}
+
+    async def slow_refresh():
+        job["started"].set()
+        try:
+            await asyncio.sleep(60)
+        finally:
+            job["closed"] = True
+
+    strategy._run_refresh = slow_refresh
+
+    await strategy.start_background_tasks()
+    task = strategy._scheduler_task
+    await asyncio.wait_for(job["started"].wait(), 1.0)
+    await strategy.stop_background_tasks()
+
+    assert task.cancelled()
+    assert job["closed"]
+    assert strategy._scheduler_task is None
@@ -0,0 +1,49 @@
+import random
+
+from discovery.latency_tracker import LatencyTracker
+
+
+def test_quantile_empty_key():
+    """Senza campioni il quantile vale 0.0"""
+    tracker = LatencyTracker()
+
+    assert tracker.sample_count("ping") == 0
+    assert tracker.quantile("ping", 0.9) == 0.0
+
+
+def test_quantile_nearest_rank():
+    """Percentile nearest-rank su campioni noti, indipendente dall'ordine di arrivo"""
+    tracker = LatencyTracker()
+    samples = [float(value) for value in range(1, 11)]
+    random.Random(42).shuffle(samples)
+    for value in samples:
+        tracker.record("ping", value)
+
+    assert tracker.sample_count("ping") == 10
+    assert tracker.quantile("ping", 0.0) == 1.0
+    assert tracker.quantile("ping", 0.5) == 5.0
+    assert tracker.quantile("ping", 0.9) == 9.0
+    assert tracker.quantile("ping", 0.99) == 10.0
+    assert tracker.quantile("ping", 1.0) == 10.0
+
+
+def test_window_evicts_oldest_samples():
+    """Oltre DEFAULT_WINDOW_SIZE (256) campioni restano solo i più recenti"""
+    tracker = LatencyTracker()
+    for value in range(300):
+        tracker.record("ping", float(value))
+
+    assert LatencyTracker.DEFAULT_WINDOW_SIZE == 256
+    assert tracker.sample_count("ping") == 256
+    assert tracker.quantile("ping", 0.0) == 44.0
+    assert tracker.quantile("ping", 1.0) == 299.0
+
+
+def test_keys_are_independent():
+    """Ogni chiave ha la propria finestra"""
+    tracker = LatencyTracker(window_size=4)
+    tracker.record("std_discovery", 3.0)
+    tracker.record("random_walk", 7.0)
+
+    assert tracker.quantile("std_discovery", 1.0) == 3.0
+    assert tracker.quantile("random_walk", 1.0) == 7.0
@@ -0,0 +1,130 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from core.node_states import NodeInfo, NodeRole, NodeState
+from discovery.node_cache import NodeCache
+
+
+class FakeClock:
+    """Sostituto di time.monotonic() controllato dal test"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr("discovery.node_cache.time", SimpleNamespace(monotonic=fake))
+    return fake
+
+
+def make_node(name: str) -> NodeInfo:
+    return NodeInfo(
+        node_id=name,
+        address="127.0.0.1",
+        port=7000,
+        state=NodeState.ACTIVE,
+        current_role=None,
+        last_seen=datetime.now(),
+        capabilities=[NodeRole.QSG]
+    )
+
+
+def ids(nodes) -> list:
+    return [node.node_id for node in nodes]
+
+
+def add_at(cache: NodeCache, clock: FakeClock, when: float, name: str):
+    clock.now = when
+    cache.add(make_node(name))
+
+
+def test_refresh_scan_follows_verification_order(clock):
+    """Un nodo riverificato passa in coda: la scansione restituisce solo i nodi scaduti"""
+    cache = NodeCache(ttl_seconds=1000, refresh_interval_seconds=100)
+    add_at(cache, clock, 0, "A")
+    add_at(cache, clock, 10, "B")
+    add_at(cache, clock, 20, "C")
+
+    clock.now = 105
+    cache.update_verification("A", True)
+    assert cache.seconds_until_next_refresh() == 5
+
+    clock.now = 111
+    assert ids(cache.get_nodes_needing_refresh()) == ["B"]
+    assert cache.seconds_until_next_refresh() == 0.0
+
+    clock.now = 125
+    assert ids(cache.get_nodes_needing_refresh()) == ["B", "C"]
+
+    clock.now = 206
+    assert ids(cache.get_nodes_needing_refresh()) == ["B", "C", "A"]
+
+
+def test_refresh_scan_after_out_of_order_batch(clock):
+    """update_verification_many riordina i nodi nell'ordine del batch, ignorando gli assenti"""
+    cache = NodeCache(ttl_seconds=1000, refresh_interval_seconds=100)
+    for when, name in enumerate("ABCD"):
+        add_at(cache, clock, when, name)
+
+    clock.now = 50
+    assert cache.update_verification_many(["C", "missing", "A"], True) == 2
+
+    clock.now = 103.5
+    assert ids(cache.get_nodes_needing_refresh()) == ["B", "D"]
+
+    clock.now = 151
+    assert ids(cache.get_nodes_needing_refresh()) == ["B", "D", "C", "A"]
+
+
+def test_readd_moves_node_to_refresh_tail(clock):
+    """Un nodo riaggiunto riparte dal nuovo timestamp di verifica"""
+    cache = NodeCache(ttl_seconds=1000, refresh_interval_seconds=100)
+    add_at(cache, clock, 0, "A")
+    add_at(cache, clock, 10, "B")
+    add_at(cache, clock, 50, "A")
+
+    clock.now = 120
+    assert ids(cache.get_nodes_needing_refresh()) == ["B"]
+
+
+def test_cleanup_evicts_exactly_expired_nodes(clock):
+    """Con un nodo riaggiunto fuori ordine la pulizia rimuove solo i nodi scaduti"""
+    cache = NodeCache(ttl_seconds=100, refresh_interval_seconds=50)
+    add_at(cache, clock, 0, "A")
+    add_at(cache, clock, 10, "B")
+    add_at(cache, clock, 20, "C")
+    add_at(cache, clock, 50, "A")
+
+    clock.now = 115
+    assert cache.seconds_until_next_expiry() == 0.0
+    assert cache.cleanup_expired() == 1
+    assert cache.get("B") is None
+    assert ids(n for n in (cache.get("A"), cache.get("C")) if n) == ["A", "C"]
+    assert cache.seconds_until_next_expiry() == 5
+
+    clock.now = 151
+    assert cache.cleanup_expired() == 2
+    assert cache.get_all_active() == []
+    assert cache.seconds_until_next_expiry() is None
+
+
+def test_verification_does_not_extend_ttl(clock):
+    """La verifica aggiorna solo l'ordine di refresh, non la scadenza TTL"""
+    cache = NodeCache(ttl_seconds=100, refresh_interval_seconds=50)
+    add_at(cache, clock, 0, "A")
+    add_at(cache, clock, 10, "B")
+
+    clock.now = 90
+    cache.update_verification("A", True)
+
+    clock.now = 105
+    assert cache.cleanup_expired() == 1
+    assert ids(cache.get_all_active()) == ["B"]
+    assert ids(cache.get_nodes_needing_refresh()) == ["B"]
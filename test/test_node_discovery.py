@@ -0,0 +1,103 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from core.node_states import NodeInfo, NodeRole, NodeState
+from discovery.node_discovery import NodeDiscoveryService
+
+
+ACTIVE_KEY = "cqkd:discovery:nodes:active"
+
+
+class FakeServer:
+    """Server Kademlia in memoria che conta le get() per chiave"""
+
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+        self.gets = []
+
+    async def get(self, key):
+        self.gets.append(key)
+        return self.values.get(key)
+
+    async def set(self, key, value):
+        self.values[key] = value
+        return True
+
+
+class FakeCoordinator:
+    """Coordinator minimale: solo il server DHT"""
+
+    def __init__(self, server: FakeServer):
+        self.server = server
+
+
+def make_node(index: int) -> NodeInfo:
+    return NodeInfo(
+        node_id=f"{index:040x}",
+        address="127.0.0.1",
+        port=7000 + index,
+        state=NodeState.ACTIVE,
+        current_role=None,
+        last_seen=datetime.now(),
+        capabilities=[NodeRole.QSG]
+    )
+
+
+@pytest.mark.asyncio
+async def test_fixed_discovery_keys_are_cached():
+    """Le chiavi fisse di discovery vengono lette dalla DHT una sola volta entro il TTL"""
+    server = FakeServer({ACTIVE_KEY: "[]"})
+    service = NodeDiscoveryService(FakeCoordinator(server))
+
+    assert await service._get_dht_value(ACTIVE_KEY) == "[]"
+    assert await service._get_dht_value(ACTIVE_KEY) == "[]"
+    assert server.gets == [ACTIVE_KEY]
+
+
+@pytest.mark.asyncio
+async def test_missing_values_are_not_cached():
+    """L'assenza del valore non viene memorizzata: la lettura successiva torna alla DHT"""
+    server = FakeServer()
+    service = NodeDiscoveryService(FakeCoordinator(server))
+
+    assert await service._get_dht_value(ACTIVE_KEY) is None
+    server.values[ACTIVE_KEY] = "[]"
+    assert await service._get_dht_value(ACTIVE_KEY) == "[]"
+    assert server.gets == [ACTIVE_KEY, ACTIVE_KEY]
+
+
+@pytest.mark.asyncio
+async def test_region_keys_bypass_cache():
+    """Le chiavi di regione (una per target casuale) non entrano in cache"""
+    region_key = "cqkd:discovery:region:0000abcd"
+    server = FakeServer({region_key: "[]"})
+    service = NodeDiscoveryService(FakeCoordinator(server))
+
+    await service._get_dht_value(region_key)
+    await service._get_dht_value(region_key)
+
+    assert server.gets == [region_key, region_key]
+    assert service._dht_value_cache == {}
+
+
+@pytest.mark.asyncio
+async def test_publish_invalidates_cache_of_all_services():
+    """Una pubblicazione invalida la cache di tutti i servizi dello stesso coordinator"""
+    server = FakeServer({ACTIVE_KEY: "[]"})
+    coordinator = FakeCoordinator(server)
+    publisher = NodeDiscoveryService(coordinator)
+    reader = NodeDiscoveryService(coordinator)
+    other = NodeDiscoveryService(FakeCoordinator(FakeServer({ACTIVE_KEY: "[]"})))
+
+    assert await reader._get_dht_value(ACTIVE_KEY) == "[]"
+    assert await other._get_dht_value(ACTIVE_KEY) == "[]"
+
+    node = make_node(1)
+    assert await publisher.publish_node_info(node)
+
+    published = json.loads(await reader._get_dht_value(ACTIVE_KEY))
+    assert [entry["id"] for entry in published] == [node.node_id]
+    assert other._dht_value_cache is not reader._dht_value_cache
+    assert ACTIVE_KEY in other._dht_value_cache
@@ -0,0 +1,29 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from core.node_states import NodeInfo, NodeRole, NodeState
+
+
+def test_from_kademlia_reuses_id_bytes():
+    """Con node.id in bytes l'ID esadecimale deriva dai bytes, che vengono riusati"""
+    node_id = bytes(range(20))
+    node = SimpleNamespace(id=node_id, ip="10.0.0.1", port=5678)
+    seen_at = datetime.now()
+
+    info = NodeInfo.from_kademlia(node, NodeState.ACTIVE, seen_at, [NodeRole.QSG])
+
+    assert info.node_id == node_id.hex()
+    assert info.node_id_bytes is node_id
+    assert (info.address, info.port, info.last_seen) == ("10.0.0.1", 5678, seen_at)
+    assert info.current_role is None
+    assert info.capability_set == frozenset({NodeRole.QSG})
+
+
+def test_from_kademlia_with_string_id():
+    """Con un ID non in bytes i bytes vengono ricavati in modo lazy dall'esadecimale"""
+    node = SimpleNamespace(id="ab" * 20, ip="10.0.0.2", port=5679)
+
+    info = NodeInfo.from_kademlia(node, NodeState.ACTIVE, datetime.now(), [])
+
+    assert info.node_id == "ab" * 20
+    assert info.node_id_bytes == b"\xab" * 20
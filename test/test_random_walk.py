@@ -0,0 +1,121 @@
+import asyncio
+from contextlib import aclosing
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from core.node_states import NodeInfo, NodeRole, NodeState
+from discovery.discovery_strategies import PhaseQuota, SmartDiscoveryStrategy
+from discovery.random_walk import RandomWalkExplorer
+
+
+class FakeCoordinator:
+    """Coordinator minimale: i walk sono sostituiti dal test"""
+
+    def __init__(self):
+        self.server = SimpleNamespace(protocol=None)
+
+    def invalidate_routing_info_cache(self):
+        pass
+
+
+def make_node(index: int, capabilities=(NodeRole.QSG,)) -> NodeInfo:
+    return NodeInfo(
+        node_id=f"{index:040x}",
+        address="127.0.0.1",
+        port=7000 + index,
+        state=NodeState.ACTIVE,
+        current_role=None,
+        last_seen=datetime.now(),
+        capabilities=list(capabilities)
+    )
+
+
+class ScriptedWalks:
+    """_single_random_walk sostitutivo: risultati per walk_id, None = walk che non termina"""
+
+    def __init__(self, results):
+        self.results = results
+        self.cancelled = set()
+
+    async def __call__(self, walk_id: int, k: int):
+        result = self.results[walk_id]
+        if result is None:
+            try:
+                await asyncio.sleep(60)
+            finally:
+                self.cancelled.add(walk_id)
+        await asyncio.sleep(0.01 * walk_id)
+        return list(result)
+
+
+def scripted_explorer(results) -> RandomWalkExplorer:
+    explorer = RandomWalkExplorer(FakeCoordinator())
+    explorer._single_random_walk = ScriptedWalks(results)
+    return explorer
+
+
+@pytest.mark.asyncio
+async def test_iter_yields_only_new_matching_nodes():
+    """Ogni batch contiene solo nodi compatibili mai prodotti né scartati prima"""
+    qsg, qsg_bg = (NodeRole.QSG,), (NodeRole.QSG, NodeRole.BG)
+    explorer = scripted_explorer([
+        [make_node(1, qsg_bg), make_node(2, qsg)],
+        [make_node(1, qsg_bg), make_node(2, qsg_bg), make_node(3, qsg_bg)],
+        [make_node(3, qsg_bg)],
+    ])
+
+    batches = [
+        [node.node_id for node in batch]
+        async for batch in explorer.iter_explore_network(3, 20, [NodeRole.BG, NodeRole.QSG])
+    ]
+
+    # Il nodo 2 è stato scartato al primo walk: non riappare anche se poi compatibile
+    assert batches == [[f"{1:040x}"], [f"{3:040x}"]]
+
+
+@pytest.mark.asyncio
+async def test_closing_iterator_cancels_pending_walks():
+    """Chiudere il generatore cancella e attende i walk ancora in corso"""
+    explorer = scripted_explorer([[make_node(1)], None, None])
+
+    async with aclosing(explorer.iter_explore_network(3, 20)) as walks:
+        first = await walks.__anext__()
+
+    assert [node.node_id for node in first] == [f"{1:040x}"]
+    assert explorer._single_random_walk.cancelled == {1, 2}
+
+
+@pytest.mark.asyncio
+async def test_explore_network_stops_at_target():
+    """Con target raggiunto explore_network restituisce subito e cancella i walk rimasti"""
+    explorer = scripted_explorer([[make_node(1), make_node(2)], None])
+
+    nodes = await asyncio.wait_for(explorer.explore_network(2, 20, target=2), 1.0)
+
+    assert [node.node_id for node in nodes] == [f"{1:040x}", f"{2:040x}"]
+    assert explorer._single_random_walk.cancelled == {1}
+
+
+@pytest.mark.asyncio
+async def test_run_random_walk_returns_partial_batches_on_timeout():
+    """Allo scadere del timeout la fase restituisce i batch già ricevuti"""
+    strategy = SmartDiscoveryStrategy(FakeCoordinator(), enable_random_walk=True)
+    strategy.random_walk._single_random_walk = ScriptedWalks(
+        [[make_node(1), make_node(2)], None]
+    )
+    strategy.PHASE_TIMEOUT_FLOOR = 0.01
+    for _ in range(strategy.LATENCY_MIN_SAMPLES):
+        strategy._record_phase_latency("random_walk", 0.05)
+
+    phase, found = await asyncio.wait_for(
+        strategy._run_random_walk(5, None, 60.0, PhaseQuota(claimed_ids=set(), target=5)),
+        1.0
+    )
+
+    assert phase == "random_walk"
+    assert [node.node_id for node in found] == [f"{1:040x}", f"{2:040x}"]
+    assert strategy._phase_timeouts["random_walk"] == 1
+    # Quota piccola: _run_random_walk dimensiona 2 walk, il secondo viene cancellato
+    assert strategy.random_walk._single_random_walk.cancelled == {1}
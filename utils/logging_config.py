@@ -58,3 +58,17 @@ def setup_logging():
 def get_logger(name: str):
     """Ottieni un logger strutturato"""
     return structlog.get_logger(name)
+
+
+def is_enabled_for(logger, level: int) -> bool:
+    """
+    Verifica se il logger emetterà eventi al livello indicato
+
+    Permette di saltare la costruzione di payload costosi per eventi che
+    verrebbero comunque scartati. Se il logger non espone isEnabledFor
+    (structlog non ancora configurato) assume che il livello sia attivo.
+    """
+    try:
+        return logger.isEnabledFor(level)
+    except AttributeError:
+        return True